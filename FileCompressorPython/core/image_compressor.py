@@ -2,17 +2,20 @@
 from PIL import Image
 import os
 import logging
-from utils.helpers import get_compressed_name
+from utils.helpers import check_cancelled, get_compressed_name
 
 log = logging.getLogger(__name__)
 
 
-def compress_image(input_path, output_path, quality=75):
+def compress_image(input_path, output_path, quality=75, cancel=None):
+    check_cancelled(cancel)
     try:
         with Image.open(input_path) as img:
+            img.load()
             if img.mode in ("RGBA", "LA", "P"):
                 img = img.convert("RGB")
 
+            check_cancelled(cancel)  # between decoding and encoding
             img.save(output_path, "JPEG", quality=quality, optimize=True)
             log.info(f"Image compressed: {os.path.basename(input_path)} → {quality}%")
             return True, os.path.getsize(output_path)
@@ -2,125 +2,876 @@
 import tempfile
 import shutil
 import os
-from PyPDF2 import PdfReader, PdfWriter
-from PyPDF2.generic import NameObject, NumberObject
-from PIL import Image
-from io import BytesIO
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from core.pdf_images import (
+    DEFAULT_CACHE_BYTES,
+    EncodedStore,
+    ImageCache,
+    ImageRegistry,
+    encode_images,
+    page_image_keys,
+    replace_image,
+)
+from core.pdf_lossless import optimize_lossless
+from core.pdf_placement import dpi_scales
+from core.pdf_source import PdfSource, copy_stream
+from core.pdf_writer import CountingSink, PdfStreamWriter
+from core.rate_allocation import allocate, build_hulls
+from core.size_model import fit_size_model
+from utils.helpers import (
+    BudgetExhausted,
+    Cancelled,
+    check_cancelled,
+    check_deadline,
+    make_deadline,
+    MemorySampler,
+)
+from utils.progress import progress_channel
 import logging
 
 log = logging.getLogger(__name__)
 
+LINEAR_QUALITIES = range(95, 5, -10)
 
-def compress_pdf_to_target(input_path, output_path, target_bytes, update_callback):
-    best_file = None
-    best_size = float("inf")
-    log.info(f"PDF → ≤{target_bytes / (1024*1024):.2f} MB")
 
-    total_qualities = len(range(95, 5, -10))
-    quality_idx = 0
+def _make_pool(executor, workers):
+    if workers <= 1:
+        return None
+    if executor == "process":
+        return ProcessPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers)
 
-    for quality in range(95, 5, -10):
-        quality_idx += 1
-        temp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf").name
-        try:
-            reader = PdfReader(input_path)
-            writer = PdfWriter()
-            total_pages = len(reader.pages)
-            processed = 0
-
-            for page_num, page in enumerate(reader.pages, start=1):
-                try:
-                    page.compress_content_streams()
-                    if "/Resources" in page and "/XObject" in page["/Resources"]:
-                        xobj_dict = (
-                            page["/Resources"]["/XObject"].get_object()
-                            if hasattr(page["/Resources"]["/XObject"], "get_object")
-                            else page["/Resources"]["/XObject"]
-                        )
-                        for obj_name in list(xobj_dict.keys()):
-                            obj = (
-                                xobj_dict[obj_name].get_object()
-                                if hasattr(xobj_dict[obj_name], "get_object")
-                                else xobj_dict[obj_name]
-                            )
-                            if obj.get("/Subtype") != "/Image":
-                                continue
-
-                            try:
-                                data = obj.get_data()
-                                if not data:
-                                    continue
-                                img = Image.open(BytesIO(data))
-                                if img.format not in ("JPEG", "PNG", "BMP", "TIFF"):
-                                    continue
-                                if img.mode not in ("RGB", "L"):
-                                    img = img.convert("RGB")
-
-                                buf = BytesIO()
-                                img.save(buf, "JPEG", quality=quality, optimize=True)
-                                new_data = buf.getvalue()
-
-                                obj._data = new_data
-                                obj.update(
-                                    {
-                                        NameObject("/Filter"): NameObject("/DCTDecode"),
-                                        NameObject("/ColorSpace"): NameObject(
-                                            "/DeviceRGB"
-                                        ),
-                                        NameObject("/BitsPerComponent"): NumberObject(
-                                            8
-                                        ),
-                                        NameObject("/Length"): NumberObject(
-                                            len(new_data)
-                                        ),
-                                    }
-                                )
-                            except Exception:
-                                pass  # Keep original
 
+def _describe(settings):
+    if isinstance(settings, dict):
+        qualities = [q for q, _ in settings.values() if q is not None]
+        scaled = sum(1 for q, scale in settings.values() if q and scale < 1)
+        kept = len(settings) - len(qualities)
+        avg = sum(qualities) / len(qualities) if qualities else 0
+        return f"Q~{avg:.0f}/{scaled} scaled/{kept} kept"
+    return f"Q{settings}"
+
+
+def _replaced(obj, data, mode, size):
+    copy = copy_stream(obj)
+    replace_image(copy, data, mode, size)
+    return copy
+
+
+def _render_pdf(
+    source,
+    output_path,
+    settings,
+    registry,
+    on_progress,
+    pool=None,
+    window=1,
+    min_saving=0.0,
+    image_stats=None,
+    object_streams=False,
+):
+    total_pages = len(source)
+    total_images = len(registry)
+    total_steps = total_images + total_pages
+    label = _describe(settings)
+    replaced = {}  # key -> (data, mode, size) of every image re-encoded
+
+    def transform(key, obj):
+        if key in replaced:
+            return _replaced(obj, *replaced[key])
+
+    encoded = encode_images(
+        registry, settings, pool, window, min_saving=min_saving, stats=image_stats
+    )
+    for i, (canonical, keys, new_data, size) in enumerate(encoded, start=1):
+        if new_data is not None:
+            for key in keys:
+                replaced[key] = (new_data, registry.modes[canonical], size)
+        on_progress(
+            i,
+            total_steps,
+            f"{label} | I{i}/{total_images}",
+            stage="encode",
+            image=i,
+            images=total_images,
+        )
+
+    with open(output_path, "wb") as f:
+        writer = PdfStreamWriter(
+            f, source.reader, transform, object_streams, release=source.release
+        )
+        for page_num in range(1, total_pages + 1):
+            writer.add_page(source.page(page_num - 1))
+            on_progress(
+                total_images + page_num,
+                total_steps,
+                f"{label} | P{page_num}/{total_pages}",
+                stage="write",
+                page=page_num,
+                pages=total_pages,
+            )
+        writer.close()
+
+
+def _render_pdf_streaming(
+    source,
+    output_path,
+    settings,
+    registry,
+    on_progress,
+    pool=None,
+    window=1,
+    min_saving=0.0,
+    image_stats=None,
+    object_streams=False,
+    chunk_pages=16,
+):
+    # Pages are written chunk by chunk; each chunk first encodes the images
+    # its pages use, parking the JPEG data in a scratch file until every
+    # reference to it has been written.
+    canonical_of = {k: c for c, keys in registry.groups.items() for k in keys}
+    encoded = EncodedStore()
+    label = _describe(settings)
+
+    def transform(key, obj):
+        canonical = canonical_of.get(key)
+        if canonical in encoded:
+            data, size = encoded.get(canonical)
+            return _replaced(obj, data, registry.modes[canonical], size)
+
+    try:
+        with open(output_path, "wb") as out:
+            writer = PdfStreamWriter(
+                out, source.reader, transform, object_streams, release=source.release
+            )
+            total_pages = len(source)
+            attempted = set()
+            visited = set()
+            for start in range(0, total_pages, chunk_pages):
+                end = min(start + chunk_pages, total_pages)
+                pages = [source.page(i) for i in range(start, end)]
+                groups = []
+                for page in pages:
+                    for key in page_image_keys(page, visited):
+                        canonical = canonical_of.get(key)
+                        if canonical is not None and canonical not in attempted:
+                            attempted.add(canonical)
+                            groups.append(canonical)
+                for canonical, _, data, size in encode_images(
+                    registry,
+                    settings,
+                    pool,
+                    window,
+                    groups,
+                    min_saving,
+                    image_stats,
+                ):
+                    if data is not None:
+                        encoded.put(canonical, data, size)
+
+                for page in pages:
                     writer.add_page(page)
-                    processed += 1
-                    progress = 20 + (
-                        70
-                        * (quality_idx - 1 + processed / total_pages)
-                        / total_qualities
-                    )
-                    update_callback(
-                        int(progress), f"Q{quality} | P{page_num}/{total_pages}"
-                    )
-
-                except Exception as e:
-                    log.error(f"Page {page_num} error: {e}")
-                    writer.add_page(page)
+                writer.flush()
+                on_progress(
+                    end,
+                    total_pages,
+                    f"{label} | P{end}/{total_pages}",
+                    stage="write",
+                    page=end,
+                    pages=total_pages,
+                    bytes=out.tell(),
+                )
+            writer.close()
+    finally:
+        encoded.close()
+
 
-            with open(temp, "wb") as f:
-                writer.write(f)
+def _measure_fixed_bytes(source, registry, object_streams=False, check=None):
+    # Write the document once with every re-encodable image emptied; what
+    # is left does not depend on the quality setting.
+    canonical_of = {k: c for c, keys in registry.groups.items() for k in keys}
 
-            size = os.path.getsize(temp)
-            log.info(f"Quality {quality}: {size / (1024*1024):.2f} MB")
+    def transform(key, obj):
+        if key in canonical_of:
+            empty = copy_stream(obj)
+            empty._data = b""
+            return empty
 
-            if size <= target_bytes:
-                shutil.move(temp, output_path)
-                update_callback(100, "Done!")
-                return True, size
+    sink = CountingSink()
+    writer = PdfStreamWriter(
+        sink, source.reader, transform, object_streams, release=source.release
+    )
+    for index in range(len(source)):
+        if check is not None:
+            check()
+        writer.add_page(source.page(index))
+        writer.flush()
+    writer.close()
+    return sink.size
 
-            if size < best_size:
-                best_size = size
-                if best_file:
-                    os.unlink(best_file)
-                best_file = temp
+
+def bisect_search(measure, lo, hi, target, tolerance=0.05, max_passes=6, known=None):
+    """Find the highest value in [lo, hi] whose measured size fits target.
+
+    ``measure(value)`` returns the size for a value, or None on failure;
+    sizes must grow with the value.  Returns ``(best_value, sizes)``.
+    """
+    sizes = {}
+    fit = None  # highest value known to fit
+    miss = None  # lowest value known to be too big
+    low, high = lo, hi  # values not yet ruled out
+    for value, size in sorted((known or {}).items()):
+        sizes[value] = size
+        if size <= target:
+            fit, low = value, max(low, value + 1)
+        elif miss is None:
+            miss, high = value, min(high, value - 1)
+    max_passes += len(sizes)
+
+    while len(sizes) < max_passes and low <= high:
+        if fit is None and miss is None:
+            value = (low + high) // 2
+        elif fit is None:
+            value = low  # nothing fits yet: check the smallest setting
+        elif miss is None:
+            value = high  # everything fits so far: check the best setting
+        else:
+            span = high - low
+            fit_size, miss_size = sizes[fit], sizes[miss]
+            goal = target * (1 - tolerance / 2)
+            if miss_size > fit_size:
+                value = fit + round(
+                    (miss - fit) * (goal - fit_size) / (miss_size - fit_size)
+                )
             else:
-                os.unlink(temp)
+                value = (low + high) // 2
+            value = max(low + span // 4, min(high - span // 4, value))
+
+        size = measure(value)
+        sizes[value] = size
+        if size is not None and size <= target:
+            fit, low = value, value + 1
+            if size >= target * (1 - tolerance):
+                break
+        else:
+            miss, high = value, value - 1
+            if size is None:
+                sizes.pop(value)
+                max_passes -= 1
+
+    return fit, sizes
+
+
+class PassCache:
+    """Outputs of the passes made for one document, by settings.
+
+    Lets the searches for several targets reuse each other's passes; the
+    files belong to the cache until close().
+    """
+
+    def __init__(self):
+        self.outputs = {}  # settings key -> (size, path, per-image stats)
+
+    @staticmethod
+    def _key(settings):
+        return frozenset(settings.items()) if isinstance(settings, dict) else settings
+
+    def get(self, settings):
+        return self.outputs.get(self._key(settings))
+
+    def put(self, settings, size, path, image_stats):
+        self.outputs[self._key(settings)] = (size, path, image_stats)
+
+    def close(self):
+        for _, path, _ in self.outputs.values():
+            if os.path.exists(path):
+                os.unlink(path)
+        self.outputs.clear()
+
+
+class PdfJob:
+    """State shared by the passes of one target of a compression call."""
+
+    def __init__(
+        self,
+        source,
+        target_bytes,
+        update_callback,
+        registry,
+        pool,
+        workers,
+        chunk_pages=None,
+        min_saving=0.0,
+        object_streams=False,
+        deadline=None,
+        shared=None,
+        cache=None,
+        cancel=None,
+    ):
+        self.source = source
+        self.target_bytes = target_bytes
+        self.callback = update_callback
+        self.registry = registry
+        self.pool = pool
+        self.workers = workers
+        self.chunk_pages = chunk_pages  # None: render the whole document at once
+        self.min_saving = min_saving
+        self.object_streams = object_streams
+        self.best = {}  # "fit"/"small" -> (settings, size, path)
+        self.pass_images = {}  # path -> per-image stats of the pass that wrote it
+        self.images = {}  # per-image stats of the chosen output
+        self.passes = 0
+        self.total_passes = 1
+        self.deadline = deadline  # time.monotonic() at which to stop, or None
+        self.last_progress = (0, "")
+        self.shared = shared if shared is not None else {}
+        self.cache = cache
+        self.cancel = cancel  # CancellationToken or None
+
+    def update_callback(self, percent, status, **fields):
+        self.last_progress = (percent, status)
+        self.callback(percent, status, **fields)
+
+    def check(self):
+        check_cancelled(self.cancel)
+        check_deadline(self.deadline)
+
+    def fixed_bytes(self):
+        if "fixed_bytes" not in self.shared:
+            self.shared["fixed_bytes"] = _measure_fixed_bytes(
+                self.source, self.registry, self.object_streams, self.check
+            )
+        return self.shared["fixed_bytes"]
+
+    def size_model(self):
+        if "size_model" not in self.shared:
+            self.shared["size_model"] = fit_size_model(
+                self.registry, self.fixed_bytes(), pool=self.pool
+            )
+        return self.shared["size_model"]
+
+    def hulls(self):
+        if "hulls" not in self.shared:
+            self.shared["hulls"] = build_hulls(
+                self.registry, self.pool, 2 * self.workers, self.check
+            )
+        return self.shared["hulls"]
+
+    def measure(self, settings):
+        self.check()
+        cached = self.cache.get(settings) if self.cache is not None else None
+        if cached is not None:
+            size, path, self.pass_images[path] = cached
+            log.info(f"{_describe(settings)}: {size / (1024*1024):.2f} MB (reused)")
+            self._keep(settings, size, path)
+            return size
+        self.passes += 1
+        pass_idx = self.passes
+        label = _describe(settings)
+        temp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf").name
+        image_stats = self.pass_images[temp] = {}
+
+        def on_progress(done, total, status, **fields):
+            passes = max(self.total_passes, pass_idx)
+            progress = 20 + 70 * (pass_idx - 1 + done / total) / passes
+            self.update_callback(int(progress), status, **fields)
+            self.check()
 
+        try:
+            if self.chunk_pages:
+                _render_pdf_streaming(
+                    self.source,
+                    temp,
+                    settings,
+                    self.registry,
+                    on_progress,
+                    self.pool,
+                    2 * self.workers,
+                    self.min_saving,
+                    image_stats,
+                    self.object_streams,
+                    self.chunk_pages,
+                )
+            else:
+                _render_pdf(
+                    self.source,
+                    temp,
+                    settings,
+                    self.registry,
+                    on_progress,
+                    self.pool,
+                    2 * self.workers,
+                    self.min_saving,
+                    image_stats,
+                    self.object_streams,
+                )
+        except (BudgetExhausted, Cancelled):
+            if os.path.exists(temp):
+                os.unlink(temp)
+            raise
         except Exception as e:
-            log.error(f"Quality {quality} failed: {e}")
+            log.error(f"{label} failed: {e}")
             if os.path.exists(temp):
                 os.unlink(temp)
+            return None
+
+        size = os.path.getsize(temp)
+        log.info(f"{label}: {size / (1024*1024):.2f} MB")
+        if self.cache is not None:
+            self.cache.put(settings, size, temp, image_stats)
+        self._keep(settings, size, temp)
+        return size
+
+    def _discard(self, path):
+        if self.cache is None and os.path.exists(path):
+            os.unlink(path)  # files in a PassCache are the cache's to delete
+
+    def _keep(self, settings, size, path):
+        keep = []
+        if size <= self.target_bytes and size > self.best.get("fit", (0, -1))[1]:
+            keep.append("fit")
+        if size < self.best.get("small", (0, float("inf")))[1]:
+            keep.append("small")
+        for slot in keep:
+            old = self.best.get(slot)
+            self.best[slot] = (settings, size, path)
+            if old and old[2] not in (p for _, _, p in self.best.values()):
+                self._discard(old[2])
+        if not keep:
+            self._discard(path)
+
+    def fits(self, size):
+        return size is not None and size <= self.target_bytes
+
+    def finish(self, output_path):
+        chosen = self.best.get("fit") or self.best.get("small")
+        for _, _, path in self.best.values():
+            if path != chosen[2]:
+                self._discard(path)
+        self.best.clear()
+        if chosen:
+            settings, size, path = chosen
+            self.images = self.pass_images.get(path, {})
+            self.pass_images.clear()
+            if self.cache is None:
+                shutil.move(path, output_path)
+            else:
+                shutil.copyfile(path, output_path)
+            log.info(f"Chose {_describe(settings)} after {self.passes} passes")
+        return chosen
+
+
+def _search_linear(job, **kw):
+    job.total_passes = len(LINEAR_QUALITIES)
+    for quality in LINEAR_QUALITIES:
+        if job.fits(job.measure(quality)):
+            break
+
+
+def _search_bisect(job, min_quality, max_quality, tolerance, max_passes, known=None):
+    job.total_passes = job.passes + max_passes
+    bisect_search(
+        job.measure,
+        min_quality,
+        max_quality,
+        job.target_bytes,
+        tolerance=tolerance,
+        max_passes=max_passes,
+        known=known,
+    )
+
+
+def _search_estimate(job, min_quality, max_quality, tolerance, max_passes):
+    job.update_callback(20, "Estimating size...", stage="measure")
+    model = job.size_model()
+    job.total_passes = 2
+    known = {}
+    for _ in range(2):
+        quality = model.choose(job.target_bytes, min_quality, max_quality)
+        if quality in known:
+            break
+        log.info(
+            f"Predicted quality {quality}: "
+            f"{model.predict(quality) / (1024*1024):.2f} MB"
+        )
+        size = job.measure(quality)
+        if size is None:
+            break
+        known[quality] = size
+        close = size >= job.target_bytes * (1 - tolerance)
+        if job.fits(size) and (close or quality >= max_quality):
+            return  # verified, nothing left to search
+        model.calibrate(quality, size)  # refit the model to the measured size
+    _search_bisect(job, min_quality, max_quality, tolerance, max_passes, known)
+
+
+def _search_allocate(job, tolerance, max_passes, **kw):
+    job.update_callback(20, "Measuring images...", stage="measure")
+    registry = job.registry
+    hulls = job.hulls()
+    copies = {key: len(keys) for key, keys in registry.groups.items()}
+    fixed = job.fixed_bytes()
+    budget = job.target_bytes * (1 - tolerance / 2)
+    job.total_passes = max_passes
+    tried = []
+    for _ in range(max_passes):
+        settings, predicted = allocate(hulls, copies, fixed, budget)
+        if settings in tried:
+            break
+        tried.append(settings)
+        size = job.measure(settings)
+        if size is None:
+            break
+        if job.fits(size) and size >= job.target_bytes * (1 - tolerance):
+            break
+        # rescale the image budget by how far the estimate was off
+        goal = job.target_bytes * (1 - tolerance / 2)
+        budget = fixed + (predicted - fixed) * (goal - fixed) / max(size - fixed, 1)
+        if budget <= fixed:
+            break
+
+
+def _compress_lossless(
+    input_path, output_path, update_callback, object_streams, deadline, cancel, stats
+):
+    temp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf").name
+    last_status = ""
+    exhausted = False
+    memory = MemorySampler().start()
+
+    def check():
+        check_cancelled(cancel)
+        check_deadline(deadline)
 
-    if best_file:
-        shutil.move(best_file, output_path)
-        update_callback(100, "Best!")
-        return True, best_size
+    def on_progress(done, total, status):
+        nonlocal last_status
+        last_status = status
+        update_callback(int(10 + 85 * done / total), status, stage="lossless")
+        check()
 
-    update_callback(100, "No change")
-    return False, os.path.getsize(input_path)
+    try:
+        steps = optimize_lossless(input_path, temp, on_progress, object_streams, check)
+        size = os.path.getsize(temp)
+    except Cancelled:
+        os.unlink(temp)
+        raise
+    except BudgetExhausted:
+        log.warning(f"Time budget exhausted at {last_status}")
+        steps, size, exhausted = {}, None, True
+    except Exception as e:
+        log.error(f"Lossless optimisation failed: {e}")
+        steps, size = {}, None
+    finally:
+        peak = memory.stop()
+    for step, saved in steps.items():
+        log.info(f"Lossless {step}: saved {saved / 1024:.1f} KB")
+    if stats is not None:
+        stats.update(
+            passes=1,
+            steps=steps,
+            peak_rss=peak,
+            budget_exhausted=exhausted,
+            stopped_at=last_status if exhausted else None,
+        )
+    if size is None or size >= os.path.getsize(input_path):
+        if os.path.exists(temp):
+            os.unlink(temp)
+        return None
+    shutil.move(temp, output_path)
+    return size
+
+
+SEARCHES = {
+    "linear": _search_linear,
+    "bisect": _search_bisect,
+    "estimate": _search_estimate,
+    "allocate": _search_allocate,
+}
+
+
+def _explore(job, search, **kw):
+    # run the search; True if the time budget ran out before it finished
+    try:
+        if all(job.registry.modes[key] == "1" for key in job.registry.groups):
+            # no images, or only 1-bit ones: quality cannot change the size
+            job.measure(kw["max_quality"])
+        else:
+            SEARCHES[search](job, **kw)
+    except BudgetExhausted:
+        return True
+    return False
+
+
+def compress_pdf_to_target(
+    input_path,
+    output_path,
+    target_bytes,
+    update_callback,
+    search="estimate",
+    tolerance=0.05,
+    max_passes=6,
+    min_quality=5,
+    max_quality=95,
+    cache_bytes=DEFAULT_CACHE_BYTES,
+    executor="thread",
+    workers=None,
+    max_dpi=None,
+    min_saving=0.05,
+    object_streams=True,
+    memory_budget=None,
+    chunk_pages=16,
+    lossless=False,
+    classify_images=True,
+    time_budget=None,
+    deadline=None,
+    cancel=None,
+    stats=None,
+):
+    """Compress a PDF to at most target_bytes; returns ``(success, size)``."""
+    update_callback = progress_channel(update_callback)
+    if lossless:
+        log.info(f"PDF → ≤{target_bytes / (1024*1024):.2f} MB, lossless")
+        update_callback(10, "Optimising losslessly...", stage="lossless")
+        size = _compress_lossless(
+            input_path,
+            output_path,
+            update_callback,
+            object_streams,
+            make_deadline(time_budget, deadline),
+            cancel,
+            stats,
+        )
+        if size is not None:
+            update_callback(
+                100, "Done!" if size <= target_bytes else "Best!", stage="done"
+            )
+            return True, size
+        update_callback(100, "No change", stage="done")
+        return False, os.path.getsize(input_path)
+
+    figures = {}
+    [result] = compress_pdf_variants(
+        input_path,
+        [(output_path, target_bytes)],
+        update_callback,
+        search=search,
+        tolerance=tolerance,
+        max_passes=max_passes,
+        min_quality=min_quality,
+        max_quality=max_quality,
+        cache_bytes=cache_bytes,
+        executor=executor,
+        workers=workers,
+        max_dpi=max_dpi,
+        min_saving=min_saving,
+        object_streams=object_streams,
+        memory_budget=memory_budget,
+        chunk_pages=chunk_pages,
+        classify_images=classify_images,
+        time_budget=time_budget,
+        deadline=deadline,
+        cancel=cancel,
+        stats=figures,
+    )
+    if stats is not None:
+        [variant] = figures.pop("variants")
+        stats.update(figures)
+        stats.update(variant)
+    return result
+
+
+def compress_pdf_variants(
+    input_path,
+    variants,
+    update_callback,
+    search="estimate",
+    tolerance=0.05,
+    max_passes=6,
+    min_quality=5,
+    max_quality=95,
+    cache_bytes=DEFAULT_CACHE_BYTES,
+    executor="thread",
+    workers=None,
+    max_dpi=None,
+    min_saving=0.05,
+    object_streams=True,
+    memory_budget=None,
+    chunk_pages=16,
+    classify_images=True,
+    time_budget=None,
+    deadline=None,
+    cancel=None,
+    stats=None,
+):
+    """Write each ``(output_path, target_bytes)`` of variants from one analysis.
+
+    A target of None asks for the lossless optimisation.  Returns one
+    ``(success, size)`` per variant.
+    """
+    started = time.monotonic()
+    memory = MemorySampler().start()
+    update_callback = progress_channel(update_callback)
+    deadline = make_deadline(time_budget, deadline)
+    input_size = os.path.getsize(input_path)
+
+    def check():
+        check_cancelled(cancel)
+        check_deadline(deadline)
+
+    def reporter(index):
+        # each variant gets an equal share of the progress after analysis
+        if len(variants) == 1:
+            return update_callback
+        share = 80 / len(variants)
+
+        def report(percent, status, **fields):
+            progress = 20 + share * (index + max(percent - 20, 0) / 80)
+            update_callback(
+                int(progress), f"{index + 1}/{len(variants)}: {status}", **fields
+            )
+
+        return report
+
+    if memory_budget:
+        cache_bytes = min(cache_bytes, memory_budget // 2)
+    cache = ImageCache(cache_bytes)
+    registry = ImageRegistry(cache)
+    source = None
+    if any(target is not None for _, target in variants):
+        try:
+            # parsed once; every pass of every variant writes from it
+            source = PdfSource(input_path, on_demand=bool(memory_budget))
+            reader = source.reader
+            scales = dpi_scales(reader, max_dpi) if max_dpi else {}
+            if scales:
+                log.info(f"Downsampling {len(scales)} images to ≤{max_dpi} DPI")
+            registry.load(reader, scales, classify_images, check)
+        except Cancelled:
+            cache.close()
+            source.close()
+            memory.stop()
+            raise
+        except BudgetExhausted:
+            registry.groups.clear()  # the first pass stops at once too
+        except Exception as e:
+            log.error(f"Image analysis failed: {e}")
+            registry.groups.clear()
+        log.info(f"{len(registry)} unique images in {registry.references} references")
+        modes = list(registry.modes.values())
+        if modes.count("1") or modes.count("L"):
+            log.info(
+                f"{modes.count('1')} black-and-white, {modes.count('L')} gray images"
+            )
+        update_callback(
+            20, f"Decoded {len(registry)} images", stage="analyze", images=len(registry)
+        )
+
+    workers = workers or os.cpu_count() or 1
+    pool = _make_pool(executor, workers)
+    shared, passes = {}, PassCache()
+    results, variant_stats = [], []
+    try:
+        for index, (output_path, target) in enumerate(variants):
+            report = reporter(index)
+            figures = {}
+            variant_stats.append(figures)
+            if target is None:
+                log.info("PDF → lossless")
+                size = _compress_lossless(
+                    input_path,
+                    output_path,
+                    report,
+                    object_streams,
+                    deadline,
+                    cancel,
+                    figures,
+                )
+                if size is not None:
+                    report(100, "Done!", stage="done")
+                else:
+                    exhausted = figures.get("budget_exhausted")
+                    status = "Out of time" if exhausted else "No change"
+                    report(100, status, stage="done")
+                results.append((size is not None, size or input_size))
+                continue
+
+            log.info(f"PDF → ≤{target / (1024*1024):.2f} MB")
+            if source is None:
+                report(100, "No change", stage="done")
+                results.append((False, input_size))
+                continue
+            job = PdfJob(
+                source,
+                target,
+                report,
+                registry,
+                pool,
+                workers,
+                chunk_pages if memory_budget else None,
+                min_saving,
+                object_streams,
+                deadline,
+                shared,
+                passes,
+                cancel,
+            )
+            exhausted = _explore(
+                job,
+                search,
+                min_quality=min_quality,
+                max_quality=max_quality,
+                tolerance=tolerance,
+                max_passes=max_passes,
+            )
+            stopped_at = job.last_progress[1] or "image analysis"
+            if exhausted:
+                log.warning(
+                    f"Time budget exhausted after {job.passes} passes at {stopped_at}"
+                )
+            chosen = job.finish(output_path)
+            kept = sum(1 for image in job.images.values() if image["action"] == "kept")
+            if kept:
+                log.info(f"Kept {kept} original images that would not shrink")
+            figures.update(
+                passes=job.passes,
+                images=job.images,
+                budget_exhausted=exhausted,
+                stopped_at=stopped_at if exhausted else None,
+            )
+            if chosen:
+                size = chosen[1]
+                if exhausted:
+                    report(100, "Out of time, best so far", stage="done")
+                else:
+                    report(100, "Done!" if size <= target else "Best!", stage="done")
+                results.append((True, size))
+            else:
+                report(100, "Out of time" if exhausted else "No change", stage="done")
+                results.append((False, input_size))
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)  # queued encodes of a cancelled job
+        passes.close()
+        if source is not None:
+            source.close()
+        if cache.spills:
+            log.info(f"Spilled {cache.spills} decoded images to disk")
+        cache.close()
+        peak = memory.stop()
+        if peak is not None:
+            log.info(f"Peak memory: {peak / (1024*1024):.0f} MB")
+            if memory_budget and peak > memory_budget:
+                log.warning(
+                    f"Peak memory exceeded the "
+                    f"{memory_budget / (1024*1024):.0f} MB budget"
+                )
+        if stats is not None:
+            stats.update(
+                variants=variant_stats,
+                image_spills=cache.spills,
+                peak_rss=peak,
+                budget_exhausted=any(v.get("budget_exhausted") for v in variant_stats),
+                elapsed=time.monotonic() - started,
+            )
+    return results
@@ -0,0 +1,557 @@
+# core/pdf_images.py
+import hashlib
+import tempfile
+import zlib
+from collections import OrderedDict, deque
+from io import BytesIO
+from PyPDF2.generic import (
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+)
+import numpy as np
+from PIL import Image, features
+from core.image_classes import simplify
+from core.raw_decoder import decode_raw_image, filter_names
+import logging
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+# 1-bit images are stored as CCITT G4 when Pillow can write it
+BILEVEL_FILTER = "/CCITTFaxDecode" if features.check("libtiff") else "/FlateDecode"
+
+
+def image_key(ref):
+    return (ref.idnum, ref.generation)
+
+
+def resolve_image(reader, key):
+    idnum, generation = key
+    return reader.get_object(IndirectObject(idnum, generation, reader))
+
+
+def release(reader, key):
+    """Drop a resolved object from the reader's cache; it is re-read on use."""
+    idnum, generation = key
+    reader.resolved_objects.pop((generation, idnum), None)
+
+
+def _resolve(value):
+    return value.get_object() if value is not None else None
+
+
+def _walk_ref(ref, visited):
+    # images are yielded, forms and tiling patterns are walked through
+    # their own resources; every object is visited once
+    if not isinstance(ref, IndirectObject):
+        return
+    key = image_key(ref)
+    if key in visited:
+        return
+    visited.add(key)
+    obj = ref.get_object()
+    if not isinstance(obj, DictionaryObject):
+        return
+    if obj.get("/Subtype") == "/Image":
+        yield key
+        for mask in ("/SMask", "/Mask"):
+            if mask in obj:
+                yield from _walk_ref(obj.raw_get(mask), visited)
+    else:
+        yield from _walk_resources(obj.get("/Resources"), visited)
+    release(ref.pdf, key)
+
+
+def _walk_resources(resources, visited):
+    resources = _resolve(resources)
+    if not isinstance(resources, DictionaryObject):
+        return
+    for category in ("/XObject", "/Pattern"):
+        entries = _resolve(resources.get(category))
+        if isinstance(entries, DictionaryObject):
+            for name in list(entries.keys()):
+                yield from _walk_ref(entries.raw_get(name), visited)
+    # soft-mask groups of graphics states are forms as well
+    states = _resolve(resources.get("/ExtGState"))
+    if isinstance(states, DictionaryObject):
+        for state in states.values():
+            smask = _resolve(_resolve(state).get("/SMask"))
+            if isinstance(smask, DictionaryObject) and "/G" in smask:
+                yield from _walk_ref(smask.raw_get("/G"), visited)
+
+
+def _walk_appearances(annotation, visited):
+    appearances = _resolve(_resolve(annotation).get("/AP"))
+    if not isinstance(appearances, DictionaryObject):
+        return
+    for name in list(appearances.keys()):
+        ref = appearances.raw_get(name)
+        states = _resolve(ref)
+        if isinstance(states, StreamObject):
+            yield from _walk_ref(ref, visited)
+        elif isinstance(states, DictionaryObject):
+            # one appearance stream per state, e.g. /On and /Off
+            for state in list(states.keys()):
+                yield from _walk_ref(states.raw_get(state), visited)
+
+
+def page_image_keys(page, visited=None):
+    """Keys of every image a page can draw, however deeply nested.
+
+    Walks the page resources, Form XObjects, tiling patterns, soft-mask
+    groups and annotation appearance streams, including the /SMask and
+    /Mask images of each image.  Objects already in ``visited`` are
+    skipped, so sharing one set across pages reports each image once.
+    """
+    visited = set() if visited is None else visited
+    yield from _walk_resources(page.get("/Resources"), visited)
+    for annotation in _resolve(page.get("/Annots")) or []:
+        yield from _walk_appearances(annotation, visited)
+
+
+def collect_images(reader):
+    visited = set()
+    return [key for page in reader.pages for key in page_image_keys(page, visited)]
+
+
+def _identity_decode(obj):
+    # whether obj's /Decode, if any, maps every component onto itself
+    decode = _resolve(obj.get("/Decode"))
+    if decode is None:
+        return True
+    return [float(_resolve(v)) for v in decode] == [0, 1] * (len(decode) // 2)
+
+
+def decode_image(obj, scale=1.0):
+    """Decode an image XObject, downsampled by scale if below 1.
+
+    JPEG sources use Pillow's draft mode so the DCT decoder itself skips
+    the resolution that would be thrown away.  Images with a colour-key
+    /Mask, and JPEGs with a /Decode array other than the identity, come
+    back as None, to be kept as they are.
+    """
+    if isinstance(_resolve(obj.get("/Mask")), list):
+        # colour-key masking needs the exact colours, which JPEG loses
+        return None
+    target = scaled_size((int(obj["/Width"]), int(obj["/Height"])), scale)
+    if not {"/DCTDecode", "/DCT"} & set(filter_names(obj)):
+        img = decode_raw_image(obj)
+    else:
+        data = obj.get_data()
+        if not data:
+            return None
+        img = Image.open(BytesIO(data))
+        if img.format != "JPEG" or not _identity_decode(obj):
+            return None
+        if scale < 1:
+            img.draft(None, target)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    if scale < 1 and img.size != target:
+        img = img.resize(target, Image.LANCZOS, reducing_gap=2.0)
+    img.load()
+    return img
+
+
+def scaled_size(size, scale):
+    width, height = size
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def encode_jpeg(img, quality, scale=1.0):
+    if scale < 1:
+        img = img.resize(scaled_size(img.size, scale), Image.LANCZOS, reducing_gap=2.0)
+    buf = BytesIO()
+    img.save(buf, "JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def bilevel_scaled(img, scale=1.0):
+    """Downsample a mode "1" image as gray and threshold it again."""
+    if scale >= 1:
+        return img
+    size = scaled_size(img.size, scale)
+    gray = img.convert("L").resize(size, Image.LANCZOS, reducing_gap=2.0)
+    return Image.fromarray(np.asarray(gray) >= 128)
+
+
+def encode_bilevel(img, scale=1.0):
+    img = bilevel_scaled(img, scale)
+    if BILEVEL_FILTER == "/FlateDecode":
+        return zlib.compress(img.tobytes(), 9)
+    # G4 codes white runs as 0 bits where mode "1" has white as 1; one strip
+    # for the whole image makes the strip a complete CCITT stream
+    buf = BytesIO()
+    inverted = Image.fromarray(~np.asarray(img))
+    inverted.save(buf, "TIFF", compression="group4", tiffinfo={278: img.height})
+    with Image.open(buf) as tiff:
+        offsets, counts = tiff.tag_v2[273], tiff.tag_v2[279]
+    if len(offsets) != 1:
+        raise ValueError(f"G4 image written in {len(offsets)} strips")
+    return buf.getvalue()[offsets[0] : offsets[0] + counts[0]]
+
+
+def encode_image(img, quality, scale=1.0):
+    """JPEG at quality, or for a mode "1" image 1-bit data (quality unused)."""
+    if img.mode == "1":
+        return encode_bilevel(img, scale)
+    return encode_jpeg(img, quality, scale)
+
+
+def replace_image(obj, data, mode="RGB", size=None):
+    """Point obj at data from encode_image for an image of that mode."""
+    if mode != "1":
+        replace_with_jpeg(obj, data, mode, size)
+        return
+    width, height = size or (int(obj["/Width"]), int(obj["/Height"]))
+    obj._data = data
+    for stale in ("/DecodeParms", "/Decode"):
+        obj.pop(stale, None)
+    obj.update(
+        {
+            NameObject("/Width"): NumberObject(width),
+            NameObject("/Height"): NumberObject(height),
+            NameObject("/Filter"): NameObject(BILEVEL_FILTER),
+            NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+            NameObject("/BitsPerComponent"): NumberObject(1),
+            NameObject("/Length"): NumberObject(len(data)),
+        }
+    )
+    if BILEVEL_FILTER == "/CCITTFaxDecode":
+        obj[NameObject("/DecodeParms")] = DictionaryObject(
+            {
+                NameObject("/K"): NumberObject(-1),
+                NameObject("/Columns"): NumberObject(width),
+                NameObject("/Rows"): NumberObject(height),
+            }
+        )
+
+
+def replace_with_jpeg(obj, data, mode="RGB", size=None):
+    obj._data = data
+    for stale in ("/DecodeParms", "/Decode"):
+        obj.pop(stale, None)
+    if size is not None:
+        obj[NameObject("/Width")] = NumberObject(size[0])
+        obj[NameObject("/Height")] = NumberObject(size[1])
+    obj.update(
+        {
+            NameObject("/Filter"): NameObject("/DCTDecode"),
+            NameObject("/ColorSpace"): NameObject(
+                "/DeviceGray" if mode == "L" else "/DeviceRGB"
+            ),
+            NameObject("/BitsPerComponent"): NumberObject(8),
+            NameObject("/Length"): NumberObject(len(data)),
+        }
+    )
+
+
+def _nbytes(img):
+    return img.width * img.height * len(img.getbands())
+
+
+class ImageCache:
+    """Decoded images of one job, keyed by indirect reference.
+
+    At most ``max_bytes`` of pixels stay in memory; the least recently used
+    images are spilled to a scratch file and read back when needed again.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.spills = 0
+        self._mem = OrderedDict()
+        self._mem_bytes = 0
+        self._disk = {}  # key -> (mode, size, offset, length)
+        self._scratch = None
+
+    def __contains__(self, key):
+        return key in self._mem or key in self._disk
+
+    def __len__(self):
+        return len(self._mem.keys() | self._disk.keys())
+
+    def put(self, key, img):
+        if key in self._mem:
+            self._mem_bytes -= _nbytes(self._mem.pop(key))
+        self._mem[key] = img
+        self._mem_bytes += _nbytes(img)
+        self._evict()
+
+    def get(self, key):
+        if key in self._mem:
+            self._mem.move_to_end(key)
+            return self._mem[key]
+        mode, size, offset, length = self._disk[key]
+        self._scratch.seek(offset)
+        img = Image.frombytes(mode, size, self._scratch.read(length))
+        self.put(key, img)
+        return img
+
+    def _evict(self):
+        while self._mem_bytes > self.max_bytes and len(self._mem) > 1:
+            key, img = self._mem.popitem(last=False)
+            self._mem_bytes -= _nbytes(img)
+            if key in self._disk:
+                continue  # already spilled, pixels never change
+            if self._scratch is None:
+                self._scratch = tempfile.TemporaryFile(suffix=".pixels")
+            data = img.tobytes()
+            offset = self._scratch.seek(0, 2)
+            self._scratch.write(data)
+            self._disk[key] = (img.mode, img.size, offset, len(data))
+            self.spills += 1
+
+    def close(self):
+        self._mem.clear()
+        self._disk.clear()
+        self._mem_bytes = 0
+        if self._scratch is not None:
+            self._scratch.close()
+            self._scratch = None
+
+
+class EncodedStore:
+    """Encoded images of one pass, kept in a scratch file until written."""
+
+    def __init__(self):
+        self._index = {}  # canonical key -> (size, offset, length)
+        self._scratch = tempfile.TemporaryFile(suffix=".jpeg")
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def put(self, key, data, size):
+        offset = self._scratch.seek(0, 2)
+        self._scratch.write(data)
+        self._index[key] = (size, offset, len(data))
+
+    def get(self, key):
+        size, offset, length = self._index[key]
+        self._scratch.seek(offset)
+        return self._scratch.read(length), size
+
+    def close(self):
+        self._index.clear()
+        self._scratch.close()
+
+
+IMAGE_KEYS = (
+    "/Width",
+    "/Height",
+    "/ColorSpace",
+    "/BitsPerComponent",
+    "/Filter",
+    "/DecodeParms",
+    "/Decode",
+    "/ImageMask",
+)
+MAX_HASH_DEPTH = 8
+
+
+def _hash_value(value, h, depth=0):
+    # indirect references are hashed by what they point to, so equal
+    # entries written as separate objects still match
+    value = _resolve(value)
+    if depth > MAX_HASH_DEPTH:
+        raise ValueError("image entry nested too deeply")
+    if isinstance(value, StreamObject):
+        h.update(b"stream" + hashlib.sha256(value._data).digest())
+    if isinstance(value, DictionaryObject):
+        h.update(b"<<")
+        for k in sorted(value.keys()):
+            if k != "/Length":
+                h.update(k.encode())
+                _hash_value(value.raw_get(k), h, depth + 1)
+        h.update(b">>")
+    elif isinstance(value, list):
+        h.update(b"[")
+        for item in value:
+            _hash_value(item, h, depth + 1)
+        h.update(b"]")
+    else:
+        h.update(repr(value).encode() + b" ")
+
+
+def content_hash(obj):
+    """Hash of an image's data and of every entry that changes its pixels.
+
+    None if an entry cannot be hashed; such an image is not grouped.
+    """
+    h = hashlib.sha256(obj._data)
+    try:
+        for name in IMAGE_KEYS:
+            h.update(name.encode())
+            _hash_value(obj.raw_get(name) if name in obj else None, h)
+    except ValueError:
+        return None
+    return h.hexdigest()
+
+
+class ImageRegistry:
+    """Unique images of one job.
+
+    Images are grouped by indirect reference and by a hash of their raw
+    stream, so a letterhead shared by every page -- or copied into every
+    page as identical streams -- is decoded once and re-encoded once per
+    quality, then written back to every reference.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.groups = OrderedDict()  # canonical key -> every key with that content
+        self.modes = {}  # canonical key -> PIL mode of the decoded image
+        self.dims = {}  # canonical key -> (width, height)
+        self.pixels = {}  # canonical key -> width * height
+        self.original = {}  # canonical key -> bytes of the original stream
+        self.no_gain = {}  # canonical key -> settings that saved too little
+        self.downsampled = set()  # canonical keys decoded below their resolution
+
+    def __len__(self):
+        return len(self.groups)
+
+    @property
+    def references(self):
+        return sum(len(keys) for keys in self.groups.values())
+
+    def load(self, reader, scales=None, classify=True, check=None):
+        """Group and decode every image; scales maps keys to downsampling.
+
+        With ``classify`` images that are effectively gray are kept as one
+        channel and effectively black-and-white ones as 1-bit.  ``check``,
+        if given, is called before each image and may raise to stop.
+        """
+        scales = scales or {}
+        by_hash = OrderedDict()
+        original = {}
+        for key in collect_images(reader):
+            if check is not None:
+                check()
+            obj = resolve_image(reader, key)
+            digest = content_hash(obj) or key
+            original[digest] = len(obj._data)
+            release(reader, key)
+            by_hash.setdefault(digest, []).append(key)
+
+        for digest, keys in by_hash.items():
+            if check is not None:
+                check()
+            canonical = keys[0]
+            # a copy drawn without downsampling keeps the whole group sharp
+            scale = max(scales.get(key, 1.0) for key in keys)
+            try:
+                img = decode_image(resolve_image(reader, canonical), scale)
+            except Exception as e:
+                log.debug(f"Keep original image {canonical}: {e}")
+                img = None
+            release(reader, canonical)
+            if img is None:
+                continue
+            if classify:
+                img = simplify(img)
+            self.add(keys, img, original[digest])
+            if scale < 1:
+                self.downsampled.add(canonical)
+        return self
+
+    def add(self, keys, img, original):
+        """Add one decoded image, referenced by keys, of original bytes."""
+        canonical = keys[0]
+        self.cache.put(canonical, img)
+        self.groups[canonical] = keys
+        self.modes[canonical] = img.mode
+        self.dims[canonical] = img.size
+        self.pixels[canonical] = img.width * img.height
+        self.original[canonical] = original
+
+
+def image_setting(settings, canonical):
+    """(quality, scale) for one image; settings is a quality or a mapping.
+
+    A quality of None keeps the original stream.
+    """
+    if isinstance(settings, dict):
+        return settings[canonical]
+    return settings, 1.0
+
+
+def encode_images(
+    registry, settings, pool=None, window=1, groups=None, min_saving=0.0, stats=None
+):
+    """Yield ``(canonical, keys, data, size)`` for every group, in order.
+
+    data is None when the original stream should be kept.
+    """
+    pending = deque()
+    for canonical in registry.groups if groups is None else groups:
+        keys = registry.groups[canonical]
+        quality, scale = image_setting(settings, canonical)
+        size = scaled_size(registry.dims[canonical], scale)
+        if quality is None or _no_gain(registry, canonical, quality, scale):
+            result = None
+        else:
+            img = registry.cache.get(canonical)
+            if pool is None:
+                result = _encode_now(img, quality, scale)
+            else:
+                result = pool.submit(encode_image, img, quality, scale)
+        pending.append((canonical, keys, result, size, quality, scale))
+        while len(pending) >= window:
+            yield _finish(registry, *pending.popleft(), min_saving, stats)
+    while pending:
+        yield _finish(registry, *pending.popleft(), min_saving, stats)
+
+
+def _no_gain(registry, canonical, quality, scale):
+    # JPEG size grows with quality and scale, so anything at or above a
+    # setting that did not pay off will not pay off either
+    return any(
+        quality >= q and scale >= s for q, s in registry.no_gain.get(canonical, ())
+    )
+
+
+def _may_keep(registry, canonical, scale):
+    # a downsampled image never goes back to its original stream, which
+    # would break the DPI ceiling or the allocated scale
+    return scale >= 1 and canonical not in registry.downsampled
+
+
+def _encode_now(img, quality, scale):
+    try:
+        return encode_image(img, quality, scale)
+    except Exception as e:
+        return e
+
+
+def _finish(registry, canonical, keys, result, size, quality, scale, saving, stats):
+    try:
+        data = result.result() if hasattr(result, "result") else result
+    except Exception as e:
+        data = e
+    original = registry.original[canonical]
+    encoded = None
+    if isinstance(data, Exception):
+        log.debug(f"Keep original image {canonical}: {data}")
+        data, action = None, "failed"
+    elif data is None:
+        action = "kept"
+    elif len(data) > original * (1 - saving) and _may_keep(registry, canonical, scale):
+        log.debug(
+            f"Keep original image {canonical}: Q{quality} is {len(data)} bytes, "
+            f"original {original}"
+        )
+        registry.no_gain.setdefault(canonical, []).append((quality, scale))
+        encoded, data, action = len(data), None, "kept"
+    else:
+        encoded, action = len(data), "reencoded"
+    if stats is not None:
+        stats[canonical] = {
+            "references": len(keys),
+            "original": original,
+            "encoded": encoded,
+            "action": action,
+        }
+    return canonical, keys, data, size
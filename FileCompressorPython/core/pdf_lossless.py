@@ -0,0 +1,429 @@
+# core/pdf_lossless.py
+import struct
+import zlib
+from io import BytesIO
+from PIL import Image
+from PyPDF2 import PageObject, PdfReader
+from PyPDF2.generic import (
+    ArrayObject,
+    ContentStream,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+)
+from core.pdf_writer import CountingSink, PdfStreamWriter, serialized_size
+from core.raw_decoder import filter_names, inflate_samples
+import logging
+
+log = logging.getLogger(__name__)
+
+PNG_MODES = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}
+RESOURCE_OPERATORS = {
+    b"Do": "/XObject",
+    b"Tf": "/Font",
+    b"gs": "/ExtGState",
+    b"sh": "/Shading",
+    b"cs": "/ColorSpace",
+    b"CS": "/ColorSpace",
+}
+RESOURCE_CATEGORIES = (
+    "/XObject",
+    "/Font",
+    "/ExtGState",
+    "/Shading",
+    "/ColorSpace",
+    "/Pattern",
+    "/Properties",
+)
+METADATA_KEYS = ("/Metadata", "/PieceInfo")
+
+
+def _is_page_tree(obj):
+    return isinstance(obj, DictionaryObject) and obj.get("/Type") in (
+        "/Page",
+        "/Pages",
+    )
+
+
+def _reachable(reader):
+    # every indirect object the pages reach, without climbing back up the
+    # page tree through /Parent
+    found = {}
+    stack = []
+    for page in reader.pages:
+        ref = page.indirect_reference
+        if ref is not None:
+            found[(ref.idnum, ref.generation)] = page
+        stack.append(page)
+    while stack:
+        value = stack.pop()
+        if isinstance(value, IndirectObject):
+            key = (value.idnum, value.generation)
+            if key in found:
+                continue
+            obj = found[key] = value.get_object()
+            if isinstance(obj, DictionaryObject) and obj.get("/Type") == "/Pages":
+                continue
+            stack.append(obj)
+        elif isinstance(value, DictionaryObject):
+            page_tree = _is_page_tree(value)
+            for k in value:
+                if not (page_tree and k == "/Parent"):
+                    stack.append(value.raw_get(k))
+        elif isinstance(value, ArrayObject):
+            stack.extend(value)
+    return found
+
+
+def _apply(key, obj, edits, streams):
+    """Carry out the edits recorded for one object."""
+    for path, names in edits.get(key, ()):
+        target = obj
+        for name in path:
+            target = target.raw_get(name)
+        for name in names:
+            target.pop(name, None)
+    if key in streams:
+        data, parms = streams[key]
+        obj._data = data
+        obj[NameObject("/Filter")] = NameObject("/FlateDecode")
+        if parms is None:
+            obj.pop("/DecodeParms", None)
+        else:
+            obj[NameObject("/DecodeParms")] = parms
+
+
+def _dropped_size(before, after):
+    return sum(serialized_size(obj) for key, obj in before.items() if key not in after)
+
+
+def _entry_size(name, value):
+    sink = CountingSink()
+    value.write_to_stream(sink, None)
+    return len(name) + 1 + sink.size
+
+
+def _strip(key, obj, names, edits):
+    # returns the bytes of the entries removed, excluding what they point to
+    removed = [name for name in names if name in obj]
+    if not removed:
+        return 0
+    edits.setdefault(key, []).append(((), removed))
+    size = 0
+    for name in removed:
+        size += _entry_size(name, obj.raw_get(name))
+        del obj[name]
+    return size
+
+
+def _write(input_path, out, edits, streams, object_streams, deduplicate, check):
+    # the input with the edits carried out, from a fresh reader as writing
+    # empties its pages; returns the bytes written and the writer
+    reader = PdfReader(input_path)
+
+    def transform(key, obj):
+        _apply(key, obj, edits, streams)
+
+    writer = PdfStreamWriter(out, reader, transform, object_streams, deduplicate)
+    for page in reader.pages:
+        if check is not None:
+            check()
+        ref = page.indirect_reference
+        if ref is not None:
+            _apply((ref.idnum, ref.generation), page, edits, streams)
+        writer.add_page(page)
+        writer.flush()
+    writer.close()
+    return out.tell(), writer
+
+
+def _written_size(input_path, edits, streams, deduplicate=False, check=None):
+    sink = CountingSink()
+    return _write(input_path, sink, edits, streams, False, deduplicate, check)[0]
+
+
+def _used_names(contents, reader):
+    # resource names a content stream refers to, by category
+    used = {category: set() for category in RESOURCE_CATEGORIES}
+    for operands, operator in ContentStream(contents, reader).operations:
+        if operator in RESOURCE_OPERATORS and operands:
+            used[RESOURCE_OPERATORS[operator]].add(operands[0])
+        elif operator in (b"scn", b"SCN") and operands:
+            if isinstance(operands[-1], NameObject):
+                used["/Pattern"].add(operands[-1])
+        elif operator in (b"BDC", b"DP") and len(operands) > 1:
+            if isinstance(operands[1], NameObject):
+                used["/Properties"].add(operands[1])
+        elif operator == b"INLINE IMAGE":
+            settings = operands["settings"]
+            for name in ("/CS", "/ColorSpace"):
+                if isinstance(settings.get(name), NameObject):
+                    used["/ColorSpace"].add(settings[name])
+    return used
+
+
+def _locate(place, owner, name):
+    # (identity, edit location, dictionary) of owner[name]; a direct
+    # dictionary is edited through the nearest indirect object
+    raw = owner.raw_get(name)
+    if isinstance(raw, IndirectObject):
+        key = (raw.idnum, raw.generation)
+        return ("ref", key), (key, ()), raw.get_object()
+    key, path = place
+    return id(raw), (key, path + (name,)), raw
+
+
+def _borrowed_contents(obj):
+    # content streams without resources of their own use those of the page
+    # that draws them
+    if isinstance(obj, StreamObject):
+        if obj.get("/Subtype") == "/Form" or obj.get("/PatternType") == 1:
+            return [obj]
+    elif obj.get("/Subtype") == "/Type3" and "/CharProcs" in obj:
+        return [proc.get_object() for proc in obj["/CharProcs"].values()]
+    return []
+
+
+def _prune_resources(reachable, reader, edits):
+    # Names are dropped from a resource dictionary only when no content
+    # stream using it refers to them; a dictionary shared by several pages
+    # or forms keeps the union of their uses, and names used by streams
+    # that borrow their page's resources are kept everywhere.
+    uses, places, unknown = {}, {}, set()
+    anywhere = {category: set() for category in RESOURCE_CATEGORIES}
+    for key, obj in reachable.items():
+        if not isinstance(obj, DictionaryObject):
+            continue
+        if "/Resources" not in obj:
+            try:
+                for contents in _borrowed_contents(obj):
+                    for category, names in _used_names(contents, reader).items():
+                        anywhere[category].update(names)
+            except Exception as e:
+                log.debug(f"Object {key}: keeping all resources: {e}")
+                return 0
+            continue
+        try:
+            _, place, resources = _locate((key, ()), obj, "/Resources")
+            categories = {}
+            for category in RESOURCE_CATEGORIES:
+                if category in resources:
+                    ident, at, names = _locate(place, resources, category)
+                    if isinstance(names, DictionaryObject):
+                        categories[category] = ident
+                        places.setdefault(ident, (category, names, []))[2].append(at)
+        except Exception as e:
+            log.debug(f"Object {key}: cannot read resources: {e}")
+            continue
+        try:
+            if isinstance(obj, PageObject):
+                contents = obj.get_contents()
+                used = _used_names(contents, reader) if contents is not None else {}
+            elif isinstance(obj, StreamObject):
+                used = _used_names(obj, reader)
+            else:
+                raise ValueError("not a content stream")  # e.g. a Type3 font
+        except Exception as e:
+            log.debug(f"Object {key}: keeping all resources: {e}")
+            unknown.update(categories.values())
+            continue
+        for category, ident in categories.items():
+            uses.setdefault(ident, set()).update(used.get(category, ()))
+
+    removed = 0
+    for ident, names_used in uses.items():
+        if ident in unknown:
+            continue
+        category, names, at = places[ident]
+        keep = names_used | anywhere[category]
+        unused = [name for name in names if name not in keep]
+        if not unused:
+            continue
+        for key, path in at:
+            edits.setdefault(key, []).append((path, unused))
+        for name in unused:
+            removed += 1
+            del names[name]
+    return removed
+
+
+def _png_predicted(data, width, height, ncomp):
+    # Pillow picks a PNG filter per row; the IDAT payload is exactly a
+    # Flate stream with /Predictor 15
+    img = Image.frombytes(PNG_MODES[ncomp], (width, height), data)
+    out = BytesIO()
+    img.save(out, "PNG", optimize=True)
+    png = out.getvalue()
+    pos, idat = 8, []
+    while pos < len(png):
+        length, kind = struct.unpack(">I4s", png[pos : pos + 8])
+        if kind == b"IDAT":
+            idat.append(png[pos + 8 : pos + 8 + length])
+        pos += 12 + length
+    return b"".join(idat)
+
+
+def _recompress(obj):
+    # smallest lossless Flate encoding of a stream as (data, decode parms),
+    # or None when the stream is best left as it is
+    if obj.get("/Subtype") == "/Image":
+        samples = inflate_samples(obj)
+        if samples is None:
+            return None
+        data, ncomp = samples
+        candidates = [(zlib.compress(data, 9), None)]
+        if int(obj.get("/BitsPerComponent", 8)) == 8 and ncomp in PNG_MODES:
+            width, height = int(obj["/Width"]), int(obj["/Height"])
+            try:
+                predicted = _png_predicted(data, width, height, ncomp)
+                parms = DictionaryObject(
+                    {
+                        NameObject("/Predictor"): NumberObject(15),
+                        NameObject("/Colors"): NumberObject(ncomp),
+                        NameObject("/BitsPerComponent"): NumberObject(8),
+                        NameObject("/Columns"): NumberObject(width),
+                    }
+                )
+                candidates.append((predicted, parms))
+            except ValueError as e:
+                log.debug(f"Cannot predict image: {e}")
+    else:
+        filters = filter_names(obj)
+        if filters not in ([], ["/FlateDecode"], ["/Fl"]):
+            return None
+        if "/DecodeParms" in obj or obj.get("/Type") == "/Metadata":
+            return None
+        data = zlib.decompress(obj._data) if filters else obj._data
+        candidates = [(zlib.compress(data, 9), None)]
+    best = min(candidates, key=lambda c: _flate_size(*c))
+    return best if _flate_size(*best) < _stream_size(obj) else None
+
+
+def _encoded_size(data, filters, parms):
+    # data with the /Filter and /DecodeParms entries that go with it
+    sink = CountingSink()
+    for name, value in (("/Filter ", filters), ("/DecodeParms ", parms)):
+        if value is not None:
+            sink.write(name.encode())
+            value.write_to_stream(sink, None)
+    return len(data) + sink.size
+
+
+def _stream_size(obj):
+    return _encoded_size(
+        obj._data,
+        obj.raw_get("/Filter") if "/Filter" in obj else None,
+        obj.raw_get("/DecodeParms") if "/DecodeParms" in obj else None,
+    )
+
+
+def _flate_size(data, parms):
+    return _encoded_size(data, NameObject("/FlateDecode"), parms)
+
+
+def optimize_lossless(
+    input_path,
+    output_path,
+    on_progress=None,
+    object_streams=True,
+    check=None,
+    exact_steps=False,
+):
+    """Shrink a PDF without changing how any page renders.
+
+    Returns the bytes each step saved, estimated from the serialized size
+    of what it removed or replaced; "rewrite" is the rest of the difference
+    to the input.  ``exact_steps`` writes the document after every step to
+    measure them instead, at the cost of a full write each.
+    """
+    steps = {}
+    edits = {}  # (idnum, generation) -> [(path to a dictionary, names to drop)]
+    streams = {}  # (idnum, generation) -> (new data, decode parms)
+
+    def progress(done, status):
+        if on_progress is not None:
+            on_progress(done, 5, status)
+
+    def measure(step, estimate, deduplicate=False):
+        # the estimate, or with exact_steps the drop in written size
+        nonlocal size
+        if not exact_steps:
+            steps[step] = estimate
+        elif estimate:
+            new = _written_size(input_path, edits, streams, deduplicate, check)
+            steps[step], size = size - new, new
+        else:
+            steps[step] = 0
+
+    with open(input_path, "rb") as f:
+        f.seek(0, 2)
+        input_size = f.tell()
+    reader = PdfReader(input_path)
+    reachable = _reachable(reader)
+
+    progress(0, "Removing thumbnails...")
+    size = input_size
+    if exact_steps:
+        size = _written_size(input_path, edits, streams, check=check)
+        steps["rewrite"] = input_size - size
+    removed = 0
+    for key, obj in reachable.items():
+        if isinstance(obj, PageObject):
+            removed += _strip(key, obj, ("/Thumb",), edits)
+    after = _reachable(reader)
+    measure("thumbnails", removed + _dropped_size(reachable, after))
+    reachable = after
+
+    progress(1, "Removing metadata...")
+    removed = 0
+    for key, obj in reachable.items():
+        if isinstance(obj, DictionaryObject):
+            removed += _strip(key, obj, METADATA_KEYS, edits)
+    after = _reachable(reader)
+    measure("metadata", removed + _dropped_size(reachable, after))
+    reachable = after
+
+    progress(2, "Removing unused resources...")
+    removed = _prune_resources(reachable, reader, edits)
+    after = _reachable(reader)
+    measure("resources", _dropped_size(reachable, after) if removed else 0)
+    reachable = after
+    if removed:
+        log.info(f"Removed {removed} unused resources")
+
+    progress(3, "Recompressing streams...")
+    saved = 0
+    for key, obj in reachable.items():
+        if not isinstance(obj, StreamObject):
+            continue
+        if check is not None:
+            check()
+        try:
+            result = _recompress(obj)
+        except Exception as e:
+            log.debug(f"Object {key}: cannot recompress: {e}")
+            continue
+        if result is not None:
+            saved += _stream_size(obj) - _flate_size(*result)
+            streams[key] = result
+    log.info(f"Recompressed {len(streams)} streams")
+    del reader, reachable, after
+    measure("recompress", saved)
+    if exact_steps:
+        measure("deduplicate", True, deduplicate=True)
+
+    progress(4, "Writing...")
+    with open(output_path, "wb") as out:
+        total, writer = _write(
+            input_path, out, edits, streams, object_streams, True, check
+        )
+    if exact_steps:
+        steps["object_streams"] = size - total
+    else:
+        steps["deduplicate"] = writer.duplicate_bytes
+        steps["object_streams"] = writer.packing_saved
+        steps["rewrite"] = input_size - total - sum(steps.values())
+    progress(5, "Written")
+    return steps
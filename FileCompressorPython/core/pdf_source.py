@@ -0,0 +1,53 @@
+# core/pdf_source.py
+from PyPDF2 import PageObject, PdfReader
+from PyPDF2.generic import NameObject, StreamObject
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def copy_stream(obj):
+    """Shallow copy of a stream object, for changes that must not stick."""
+    copy = StreamObject()
+    copy.update(obj)
+    copy._data = obj._data
+    return copy
+
+
+class PdfSource:
+    """The input PDF of a job, parsed once and shared by all its passes.
+
+    With ``on_demand`` objects are parsed when needed and nothing per page
+    is kept, bounding memory at the cost of parsing once per pass.
+    """
+
+    def __init__(self, input_path, on_demand=False):
+        self._file = open(input_path, "rb")
+        self.reader = PdfReader(self._file if on_demand else input_path)
+        self.release = on_demand
+        self.contents = {}  # page index -> compressed /Contents, None if it failed
+        if not on_demand:
+            self._file.close()
+
+    def __len__(self):
+        return len(self.reader.pages)
+
+    def page(self, index):
+        # a shallow copy: passes never change the parsed objects (see copy_stream)
+        original = self.reader.pages[index]
+        page = PageObject(self.reader, original.indirect_reference)
+        page.update(original)
+        if index not in self.contents:
+            try:
+                page.compress_content_streams()
+                if not self.release:
+                    self.contents[index] = page.get(NameObject("/Contents"))
+            except Exception as e:
+                log.error(f"Page {index + 1} error: {e}")
+                self.contents[index] = None
+        elif self.contents[index] is not None:
+            page[NameObject("/Contents")] = self.contents[index]
+        return page
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,217 @@
+# core/raw_decoder.py
+import struct
+import zlib
+from io import BytesIO
+import numpy as np
+from PIL import Image
+
+DEVICE_COMPONENTS = {
+    "/DeviceGray": 1,
+    "/CalGray": 1,
+    "/G": 1,
+    "/DeviceRGB": 3,
+    "/CalRGB": 3,
+    "/RGB": 3,
+    "/DeviceCMYK": 4,
+    "/CMYK": 4,
+}
+MODES = {1: "L", 3: "RGB", 4: "CMYK"}
+GENERIC_FILTERS = (
+    "/FlateDecode",
+    "/Fl",
+    "/LZWDecode",
+    "/LZW",
+    "/ASCII85Decode",
+    "/A85",
+    "/ASCIIHexDecode",
+    "/AHx",
+)
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+def _resolve(value):
+    return value.get_object() if hasattr(value, "get_object") else value
+
+
+def _as_list(value):
+    value = _resolve(value)
+    if value is None:
+        return []
+    return list(value) if isinstance(value, list) else [value]
+
+
+def filter_names(obj):
+    return [_resolve(f) for f in _as_list(obj.get("/Filter"))]
+
+
+def _lookup_bytes(lookup):
+    lookup = _resolve(lookup)
+    if hasattr(lookup, "get_data"):
+        return lookup.get_data()
+    if hasattr(lookup, "original_bytes"):
+        return lookup.original_bytes
+    return bytes(lookup)
+
+
+def color_space(cs):
+    """Return (components, palette) for a PDF colour space.
+
+    palette is an (entries, components) uint8 array for /Indexed spaces,
+    where components is that of the base space, and None otherwise.
+    """
+    cs = _resolve(cs)
+    if not isinstance(cs, list):
+        if cs not in DEVICE_COMPONENTS:
+            raise UnsupportedImage(f"colour space {cs}")
+        return DEVICE_COMPONENTS[cs], None
+
+    family = cs[0]
+    if family in ("/CalGray", "/CalRGB"):
+        return DEVICE_COMPONENTS[family], None
+    if family == "/ICCBased":
+        n = int(_resolve(cs[1])["/N"])
+        if n not in MODES:
+            raise UnsupportedImage(f"ICC profile with {n} components")
+        return n, None
+    if family in ("/Indexed", "/I"):
+        base, _ = color_space(cs[1])
+        hival = int(cs[2])
+        table = np.frombuffer(_lookup_bytes(cs[3]), dtype=np.uint8)
+        entries = min(hival + 1, len(table) // base)
+        return base, table[: entries * base].reshape(entries, base)
+    raise UnsupportedImage(f"colour space {family}")
+
+
+def _png_chunk(kind, data):
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data))
+    )
+
+
+def _png_unfilter(flate_data, width, height, ncomp):
+    # Flate data with PNG predictors is byte-for-byte a PNG IDAT stream, so
+    # let Pillow's C decoder undo the row filters.
+    color_type = {1: 0, 2: 4, 3: 2, 4: 6}[ncomp]
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    png = (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", ihdr)
+        + _png_chunk(b"IDAT", flate_data)
+        + _png_chunk(b"IEND", b"")
+    )
+    with Image.open(BytesIO(png)) as img:
+        return np.asarray(img).reshape(height, width, ncomp)
+
+
+def _unpack(data, width, height, ncomp, bpc):
+    if bpc == 8:
+        samples = np.frombuffer(data, dtype=np.uint8, count=width * height * ncomp)
+        return samples.reshape(height, width, ncomp)
+    if bpc == 16:
+        samples = np.frombuffer(data, dtype=">u2", count=width * height * ncomp)
+        return (samples >> 8).astype(np.uint8).reshape(height, width, ncomp)
+    if bpc not in (1, 2, 4):
+        raise UnsupportedImage(f"{bpc} bits per component")
+
+    row_bytes = (width * ncomp * bpc + 7) // 8
+    rows = np.frombuffer(data, dtype=np.uint8, count=row_bytes * height)
+    bits = np.unpackbits(rows.reshape(height, row_bytes), axis=1)
+    bits = bits[:, : width * ncomp * bpc].reshape(height, width * ncomp, bpc)
+    weights = (1 << np.arange(bpc - 1, -1, -1)).astype(np.uint8)
+    return (bits * weights).sum(axis=2, dtype=np.uint8).reshape(height, width, ncomp)
+
+
+def _parms(obj):
+    parms = _as_list(obj.get("/DecodeParms"))
+    parms = [_resolve(p) for p in parms if _resolve(p)]
+    return parms[-1] if parms else {}
+
+
+def inflate_samples(obj):
+    """Sample bytes of an unfiltered or Flate image, predictor undone.
+
+    Returns ``(data, ncomp)`` with ncomp the samples per pixel (None if the
+    colour space is not understood), or None for other filters and for
+    predictors this module cannot undo.
+    """
+    filters = filter_names(obj)
+    if filters not in ([], ["/FlateDecode"], ["/Fl"]):
+        return None
+    try:
+        if obj.get("/ImageMask"):
+            ncomp = 1
+        else:
+            ncomp, palette = color_space(obj["/ColorSpace"])
+            ncomp = 1 if palette is not None else ncomp
+    except (UnsupportedImage, KeyError):
+        ncomp = None
+    predictor = int(_parms(obj).get("/Predictor", 1))
+    if predictor == 1:
+        return (zlib.decompress(obj._data) if filters else obj._data), ncomp
+    bpc = int(obj.get("/BitsPerComponent", 8))
+    if predictor >= 10 and bpc == 8 and filters and ncomp:
+        width, height = int(obj["/Width"]), int(obj["/Height"])
+        return _png_unfilter(obj._data, width, height, ncomp).tobytes(), ncomp
+    return None
+
+
+def decode_raw_image(obj):
+    """Decode a non-DCT image XObject to a PIL image using NumPy.
+
+    Handles unfiltered, Flate (with PNG or TIFF predictors), LZW and ASCII
+    encoded streams, 1/2/4/8/16 bits per component, and DeviceGray/RGB/CMYK,
+    CalGray/RGB, ICCBased and Indexed colour spaces.  Anything else raises
+    UnsupportedImage so the caller keeps the original stream.
+    """
+    if obj.get("/ImageMask") or "/ColorSpace" not in obj:
+        raise UnsupportedImage("stencil mask")
+    width, height = int(obj["/Width"]), int(obj["/Height"])
+    bpc = int(obj.get("/BitsPerComponent", 8))
+    ncomp, palette = color_space(obj["/ColorSpace"])
+    nsamples = 1 if palette is not None else ncomp
+
+    filters = filter_names(obj)
+    if any(f not in GENERIC_FILTERS for f in filters):
+        raise UnsupportedImage(f"filters {filters}")
+    flate = filters in (["/FlateDecode"], ["/Fl"])
+    predictor = int(_parms(obj).get("/Predictor", 1))
+    if predictor >= 10:
+        if not flate or bpc != 8:
+            raise UnsupportedImage(f"PNG predictor with {filters}, {bpc} bits")
+        samples = _png_unfilter(obj._data, width, height, nsamples)
+    else:
+        # PyPDF2 undoes the generic filters; Flate is inflated directly so
+        # its predictor handling never runs
+        data = zlib.decompress(obj._data) if flate else obj.get_data()
+        samples = _unpack(data, width, height, nsamples, bpc)
+        if predictor == 2:
+            if bpc != 8:
+                raise UnsupportedImage(f"TIFF predictor with {bpc} bits")
+            samples = np.cumsum(samples, axis=1, dtype=np.uint8)
+        elif predictor != 1:
+            raise UnsupportedImage(f"predictor {predictor}")
+
+    decode = [float(_resolve(v)) for v in _as_list(obj.get("/Decode"))]
+    if palette is not None:
+        if decode and decode != [0, (1 << bpc) - 1]:
+            raise UnsupportedImage("indexed image with /Decode")
+        pixels = palette[np.minimum(samples[..., 0], len(palette) - 1)]
+    else:
+        maxval = (1 << bpc) - 1 if bpc < 8 else 255
+        if not decode:
+            decode = [0.0, 1.0] * ncomp
+        pixels = np.empty_like(samples)
+        for c in range(ncomp):
+            # per-component lookup table: sample -> /Decode range -> 0..255
+            lo, hi = decode[2 * c] * 255, decode[2 * c + 1] * 255
+            lut = lo + np.arange(maxval + 1, dtype=np.float32) * (hi - lo) / maxval
+            lut = np.clip(lut + 0.5, 0, 255).astype(np.uint8)
+            pixels[..., c] = lut[samples[..., c]]
+
+    return Image.frombytes(MODES[ncomp], (width, height), pixels.tobytes())
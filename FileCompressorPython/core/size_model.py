@@ -0,0 +1,123 @@
+# core/size_model.py
+from bisect import bisect_left
+from PIL import Image
+from core.pdf_images import encode_image
+import logging
+
+log = logging.getLogger(__name__)
+
+PROBE_QUALITIES = (10, 25, 40, 55, 70, 85, 95)
+SAMPLE_PIXELS = 512 * 512
+
+
+class SizeModel:
+    """Predicts the output size of a PDF for a given JPEG quality.
+
+    ``fixed_bytes`` is everything that does not depend on quality (page
+    content, fonts, images we keep as-is); ``image_bytes`` maps each probe
+    quality to the estimated total size of the re-encoded images.
+    """
+
+    def __init__(self, fixed_bytes, image_bytes):
+        self.fixed_bytes = fixed_bytes
+        self.qualities = sorted(image_bytes)
+        self.image_bytes = image_bytes
+
+    def predict(self, quality):
+        qs = self.qualities
+        if quality <= qs[0]:
+            return self.fixed_bytes + self.image_bytes[qs[0]]
+        if quality >= qs[-1]:
+            return self.fixed_bytes + self.image_bytes[qs[-1]]
+        i = bisect_left(qs, quality)
+        q0, q1 = qs[i - 1], qs[i]
+        b0, b1 = self.image_bytes[q0], self.image_bytes[q1]
+        return self.fixed_bytes + b0 + (b1 - b0) * (quality - q0) / (q1 - q0)
+
+    def calibrate(self, quality, actual):
+        """Rescale the image estimate so predict(quality) matches actual."""
+        predicted = self.predict(quality) - self.fixed_bytes
+        if predicted > 0 and actual > self.fixed_bytes:
+            factor = (actual - self.fixed_bytes) / predicted
+            self.image_bytes = {q: b * factor for q, b in self.image_bytes.items()}
+
+    def choose(self, target, lo, hi, margin=0.02):
+        """Highest quality in [lo, hi] predicted to fit with margin, else lo."""
+        for quality in range(hi, lo - 1, -1):
+            if self.predict(quality) <= target * (1 - margin):
+                return quality
+        return lo
+
+
+def sample_region(img, max_pixels=SAMPLE_PIXELS):
+    """Full-width strips spread over img, pasted together into one image.
+
+    JPEG cost per pixel of the strips tracks that of the whole image, so
+    large images can be estimated from a fraction of their pixels.
+    """
+    if img.width * img.height <= max_pixels:
+        return img
+    rows = max(16, max_pixels // img.width // 16 * 16)
+    strips = 8
+    strip_rows = max(16, rows // strips // 16 * 16)
+    stride = img.height / strips
+    region = Image.new(img.mode, (img.width, strip_rows * strips))
+    for i in range(strips):
+        top = min(int(i * stride), img.height - strip_rows)
+        strip = img.crop((0, top, img.width, top + strip_rows))
+        region.paste(strip, (0, i * strip_rows))
+    return region
+
+
+def fit_size_model(
+    registry, fixed_bytes, qualities=PROBE_QUALITIES, sample=32, pool=None
+):
+    """Encode a sample of the images at a few qualities and fit a SizeModel.
+
+    Up to ``sample`` images, spread evenly over the images sorted by pixel
+    count, are encoded (large ones through sample_region); the bytes per
+    pixel they achieve at each quality are extrapolated to the rest.  No
+    image that is not downsampled is counted above its original size,
+    since one that would grow keeps its original stream.  Each group of
+    identical images is counted once, as the writer stores it once.
+    """
+    groups = sorted(registry.groups, key=lambda k: registry.pixels[k], reverse=True)
+    if len(groups) <= sample:
+        sampled = groups
+    else:
+        step = len(groups) / sample
+        sampled = [groups[int(i * step)] for i in range(sample)]
+    rest = set(groups) - set(sampled)
+
+    def original(key):
+        if key in registry.downsampled:
+            return float("inf")  # always re-encoded
+        return registry.original[key]
+
+    regions = [sample_region(registry.cache.get(k)) for k in sampled]
+    scales = [
+        registry.pixels[k] / (r.width * r.height) for k, r in zip(sampled, regions)
+    ]
+    sample_pixels = sum(registry.pixels[k] for k in sampled)
+
+    image_bytes = {}
+    for quality in qualities:
+        if pool is None or not regions:
+            sizes = [len(encode_image(r, quality)) for r in regions]
+        else:
+            encoded = pool.map(encode_image, regions, [quality] * len(regions))
+            sizes = [len(data) for data in encoded]
+        estimates = [size * scale for size, scale in zip(sizes, scales)]
+        per_pixel = sum(estimates) / sample_pixels if sample_pixels else 0
+        image_bytes[quality] = sum(
+            min(b, original(k)) for k, b in zip(sampled, estimates)
+        ) + sum(min(per_pixel * registry.pixels[k], original(k)) for k in rest)
+
+    log.info(
+        f"Size model from {len(sampled)}/{len(groups)} images: "
+        + ", ".join(
+            f"Q{q}≈{(fixed_bytes + b) / (1024*1024):.2f} MB"
+            for q, b in image_bytes.items()
+        )
+    )
+    return SizeModel(fixed_bytes, image_bytes)
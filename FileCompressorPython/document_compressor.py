@@ -103,139 +103,195 @@ class RoundedButton(Canvas):
 # ========================================
 #           PDF COMPRESSION (ROBUST)
 # ========================================
-def compress_pdf_to_target(input_path, output_path, target_bytes, update_callback):
-    best_file = None
-    best_size = float("inf")
-    log.info(f"Starting PDF compression → target ≤{target_bytes / (1024*1024):.2f} MB")
+def render_pdf_at_quality(input_path, output_path, quality, on_page):
+    reader = PdfReader(input_path)
+    writer = PdfWriter()
+    total_pages = len(reader.pages)
 
-    total_qualities = len(range(95, 5, -10))
-    quality_idx = 0
-
-    for quality in range(95, 5, -10):
-        quality_idx += 1
-        temp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf").name
+    for page_num, page in enumerate(reader.pages, start=1):
         try:
-            reader = PdfReader(input_path)
-            writer = PdfWriter()
-            total_pages = len(reader.pages)
-            processed = 0
-
-            for page_num, page in enumerate(reader.pages, start=1):
-                try:
-                    page.compress_content_streams()
-
-                    if "/Resources" in page and "/XObject" in page["/Resources"]:
-                        xobjects = page["/Resources"]["/XObject"]
-                        xobj_dict = (
-                            xobjects.get_object()
-                            if hasattr(xobjects, "get_object")
-                            else xobjects
+            page.compress_content_streams()
+
+            if "/Resources" in page and "/XObject" in page["/Resources"]:
+                xobjects = page["/Resources"]["/XObject"]
+                xobj_dict = (
+                    xobjects.get_object()
+                    if hasattr(xobjects, "get_object")
+                    else xobjects
+                )
+
+                for obj_name in list(xobj_dict.keys()):
+                    obj = xobj_dict[obj_name]
+                    if hasattr(obj, "get_object"):
+                        obj = obj.get_object()
+
+                    if obj.get("/Subtype") != "/Image":
+                        continue
+
+                    # === ROBUST IMAGE HANDLING ===
+                    try:
+                        data = obj.get_data()
+                        if not data:
+                            continue  # Skip empty
+
+                        # Try to open with PIL
+                        img = Image.open(BytesIO(data))
+                        if img.format not in ("JPEG", "PNG", "BMP", "TIFF"):
+                            log.debug(
+                                f"Skipping non-standard image format: {img.format}"
+                            )
+                            continue
+
+                        if img.mode not in ("RGB", "L", "CMYK"):
+                            img = img.convert("RGB")
+
+                        buf = BytesIO()
+                        img.save(buf, "JPEG", quality=quality, optimize=True)
+                        new_data = buf.getvalue()
+
+                        # Replace with compressed
+                        obj._data = new_data
+                        obj.update(
+                            {
+                                NameObject("/Filter"): NameObject("/DCTDecode"),
+                                NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+                                NameObject("/BitsPerComponent"): NumberObject(8),
+                                NameObject("/Length"): NumberObject(len(new_data)),
+                            }
+                        )
+                        log.debug(
+                            f"Compressed {obj_name} → {len(new_data)/1024:.1f} KB"
                         )
 
-                        for obj_name in list(xobj_dict.keys()):
-                            obj = xobj_dict[obj_name]
-                            if hasattr(obj, "get_object"):
-                                obj = obj.get_object()
-
-                            if obj.get("/Subtype") != "/Image":
-                                continue
-
-                            # === ROBUST IMAGE HANDLING ===
-                            try:
-                                data = obj.get_data()
-                                if not data:
-                                    continue  # Skip empty
-
-                                # Try to open with PIL
-                                img = Image.open(BytesIO(data))
-                                if img.format not in ("JPEG", "PNG", "BMP", "TIFF"):
-                                    log.debug(
-                                        f"Skipping non-standard image format: {img.format}"
-                                    )
-                                    continue
-
-                                if img.mode not in ("RGB", "L", "CMYK"):
-                                    img = img.convert("RGB")
-
-                                buf = BytesIO()
-                                img.save(buf, "JPEG", quality=quality, optimize=True)
-                                new_data = buf.getvalue()
-
-                                # Replace with compressed
-                                obj._data = new_data
-                                obj.update(
-                                    {
-                                        NameObject("/Filter"): NameObject("/DCTDecode"),
-                                        NameObject("/ColorSpace"): NameObject(
-                                            "/DeviceRGB"
-                                        ),
-                                        NameObject("/BitsPerComponent"): NumberObject(
-                                            8
-                                        ),
-                                        NameObject("/Length"): NumberObject(
-                                            len(new_data)
-                                        ),
-                                    }
-                                )
-                                log.debug(
-                                    f"Compressed {obj_name} → {len(new_data)/1024:.1f} KB"
-                                )
-
-                            except Exception as img_err:
-                                # === FALLBACK: Keep original image ===
-                                log.debug(
-                                    f"Skipping uncompressible image {obj_name}: {img_err}"
-                                )
-                                # Do nothing → original image stays
-                                pass
-
-                    writer.add_page(page)
-                    processed += 1
-                    progress = 20 + (
-                        70
-                        * (quality_idx - 1 + processed / total_pages)
-                        / total_qualities
-                    )
-                    update_callback(
-                        int(progress),
-                        f"Quality {quality} | Page {page_num}/{total_pages}",
-                    )
-
-                except Exception as page_err:
-                    log.error(f"Page {page_num} error: {page_err}", exc_info=True)
-                    writer.add_page(page)
-
-            with open(temp, "wb") as f:
-                writer.write(f)
+                    except Exception as img_err:
+                        # === FALLBACK: Keep original image ===
+                        log.debug(
+                            f"Skipping uncompressible image {obj_name}: {img_err}"
+                        )
 
-            size = os.path.getsize(temp)
-            log.info(f"Quality {quality}: {size / (1024*1024):.2f} MB")
+            writer.add_page(page)
 
-            if size <= target_bytes:
-                shutil.move(temp, output_path)
-                update_callback(100, "Target Achieved!")
-                log.info(f"Success at quality {quality}")
-                return True, size
+        except Exception as page_err:
+            log.error(f"Page {page_num} error: {page_err}", exc_info=True)
+            writer.add_page(page)
 
-            if size < best_size:
-                best_size = size
-                if best_file:
-                    os.unlink(best_file)
-                best_file = temp
+        on_page(page_num, total_pages)
+
+    with open(output_path, "wb") as f:
+        writer.write(f)
+
+
+def bisect_search(measure, lo, hi, target, tolerance=0.05, max_passes=6):
+    # Highest value in [lo, hi] whose size fits target. Sizes grow with the
+    # value; measured sizes are reused to interpolate the next probe.
+    sizes = {}
+    fit = None  # highest value known to fit
+    miss = None  # lowest value known to be too big
+    low, high = lo, hi
+
+    while len(sizes) < max_passes and low <= high:
+        if fit is None and miss is None:
+            value = (low + high) // 2
+        elif fit is None:
+            value = low  # nothing fits yet → try the smallest setting
+        elif miss is None:
+            value = high  # everything fits so far → try the best setting
+        else:
+            span = high - low
+            fit_size, miss_size = sizes[fit], sizes[miss]
+            goal = target * (1 - tolerance / 2)
+            if miss_size > fit_size:
+                value = fit + round(
+                    (miss - fit) * (goal - fit_size) / (miss_size - fit_size)
+                )
             else:
-                os.unlink(temp)
+                value = (low + high) // 2
+            value = max(low + span // 4, min(high - span // 4, value))
+
+        size = measure(value)
+        sizes[value] = size
+        if size is not None and size <= target:
+            fit, low = value, value + 1
+            if size >= target * (1 - tolerance):
+                break  # close enough to target
+        else:
+            miss, high = value, value - 1
+            if size is None:
+                sizes.pop(value)
+                max_passes -= 1
+
+    return fit, sizes
+
+
+def compress_pdf_to_target(
+    input_path,
+    output_path,
+    target_bytes,
+    update_callback,
+    tolerance=0.05,
+    max_passes=6,
+):
+    log.info(f"Starting PDF compression → target ≤{target_bytes / (1024*1024):.2f} MB")
+
+    best = {}  # "fit" → closest under target, "small" → smallest overall
+    pass_idx = 0
+
+    def measure(quality):
+        nonlocal pass_idx
+        pass_idx += 1
+        temp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf").name
 
+        def on_page(page_num, total_pages):
+            progress = 20 + 70 * (pass_idx - 1 + page_num / total_pages) / max_passes
+            update_callback(
+                int(progress), f"Quality {quality} | Page {page_num}/{total_pages}"
+            )
+
+        try:
+            render_pdf_at_quality(input_path, temp, quality, on_page)
         except Exception as e:
             log.error(f"Quality {quality} failed: {e}", exc_info=True)
             if os.path.exists(temp):
                 os.unlink(temp)
+            return None
+
+        size = os.path.getsize(temp)
+        log.info(f"Quality {quality}: {size / (1024*1024):.2f} MB")
+
+        keep = []
+        if size <= target_bytes and size > best.get("fit", (0, -1))[1]:
+            keep.append("fit")
+        if size < best.get("small", (0, float("inf")))[1]:
+            keep.append("small")
+        for slot in keep:
+            old = best.get(slot)
+            best[slot] = (quality, size, temp)
+            if old and old[2] not in (p for _, _, p in best.values()):
+                os.unlink(old[2])
+        if not keep:
+            os.unlink(temp)
+        return size
+
+    bisect_search(
+        measure, 5, 95, target_bytes, tolerance=tolerance, max_passes=max_passes
+    )
 
-    # Use best effort
-    if best_file:
-        shutil.move(best_file, output_path)
-        update_callback(100, "Best Possible")
-        log.info(f"Best: {best_size / (1024*1024):.2f} MB")
-        return True, best_size
+    chosen = best.get("fit") or best.get("small")
+    for _, _, path in best.values():
+        if path != chosen[2] and os.path.exists(path):
+            os.unlink(path)
+
+    if chosen:
+        quality, size, path = chosen
+        shutil.move(path, output_path)
+        if size <= target_bytes:
+            update_callback(100, "Target Achieved!")
+            log.info(f"Success at quality {quality} after {pass_idx} passes")
+        else:
+            # Use best effort
+            update_callback(100, "Best Possible")
+            log.info(f"Best: {size / (1024*1024):.2f} MB")
+        return True, size
 
     update_callback(100, "No Improvement")
     return False, os.path.getsize(input_path)
@@ -20,7 +20,8 @@ from .popup import show_completion_popup
 from core.pdf_compressor import compress_pdf_to_target
 from core.office_compressor import compress_office_to_target
 from core.image_compressor import compress_image
-from utils.helpers import get_compressed_name
+from utils.helpers import CancellationToken, Cancelled, get_compressed_name
+from utils.progress import TkProgress
 
 
 class CompressMasterApp:
@@ -35,9 +36,13 @@ class CompressMasterApp:
         self.compression_mode = IntVar(value=1)
         self.compression_rate = IntVar(value=75)
         self.target_size = DoubleVar(value=2.0)
+        self.cancel_token = None  # token of the running job
 
         self.setup_menu()
         self.setup_ui()
+        # engines report from the worker thread; widgets change on the main loop
+        self.progress_events = TkProgress(self.root, self.show_progress)
+        self.progress_events.start()
 
     def setup_menu(self):
         menu = Menu(self.root)
@@ -82,12 +87,15 @@ class CompressMasterApp:
 
         btns = Frame(self.root, bg="#1e1e1e")
         btns.pack(pady=25)
-        RoundedButton(btns, "Browse", self.select_file, "#2196F3", "#1976D2").pack(
-            side="left", padx=25
-        )
         RoundedButton(
-            btns, "Compress", self.start_compression, "#4CAF50", "#388E3C", width=200
-        ).pack(side="right", padx=25)
+            btns, "Browse", self.select_file, "#2196F3", "#1976D2", width=140
+        ).pack(side="left", padx=10)
+        RoundedButton(
+            btns, "Cancel", self.cancel_compression, "#F44336", "#D32F2F", width=120
+        ).pack(side="left", padx=10)
+        RoundedButton(
+            btns, "Compress", self.start_compression, "#4CAF50", "#388E3C", width=180
+        ).pack(side="right", padx=10)
 
         style = ttk.Style()
         style.theme_use("clam")
@@ -122,10 +130,10 @@ class CompressMasterApp:
             filetypes=[
                 (
                     "All Supported",
-                    "*.pdf *.docx *.xlsx *.jpg *.jpeg *.png *.webp *.bmp",
+                    "*.pdf *.docx *.xlsx *.pptx *.jpg *.jpeg *.png *.webp *.bmp",
                 ),
                 ("PDF", "*.pdf"),
-                ("Office", "*.docx *.xlsx"),
+                ("Office", "*.docx *.xlsx *.pptx"),
                 ("Images", "*.jpg *.jpeg *.png *.webp *.bmp"),
             ]
         )
@@ -147,17 +155,24 @@ class CompressMasterApp:
         if not output_path:
             return
 
+        self.cancel_token = CancellationToken()
         threading.Thread(
-            target=self.compress_file, args=(path, output_path), daemon=True
+            target=self.compress_file,
+            args=(path, output_path, self.cancel_token),
+            daemon=True,
         ).start()
 
-    def compress_file(self, input_path, output_path):
-        def update(pct, txt):
-            self.progress["value"] = pct
-            self.status.config(text=txt)
-            self.root.update_idletasks()
+    def cancel_compression(self):
+        if self.cancel_token is not None and not self.cancel_token.cancelled:
+            self.cancel_token.cancel()
+            self.status.config(text="Cancelling...")
 
-        self.progress["value"] = 0
+    def show_progress(self, event):
+        self.progress["value"] = event.percent
+        self.status.config(text=event.status)
+
+    def compress_file(self, input_path, output_path, cancel):
+        update = self.progress_events
         update(0, "Analyzing...")
 
         try:
@@ -176,19 +191,24 @@ class CompressMasterApp:
 
             if ext == ".pdf":
                 success, final_size = compress_pdf_to_target(
-                    input_path, output_path, target_bytes, update
+                    input_path, output_path, target_bytes, update, cancel=cancel
                 )
-            elif ext in {".docx", ".xlsx"}:
+            elif ext in {".docx", ".xlsx", ".pptx"}:
                 success, final_size = compress_office_to_target(
-                    input_path, output_path, target_bytes, update
+                    input_path, output_path, target_bytes, update, cancel=cancel
                 )
             elif ext in {".jpg", ".jpeg", ".png", ".webp", ".bmp"}:
                 success, final_size = compress_image(
-                    input_path, output_path, quality=self.compression_rate.get()
+                    input_path,
+                    output_path,
+                    quality=self.compression_rate.get(),
+                    cancel=cancel,
                 )
-                update(100, "Done!")
+                update(100, "Done!", stage="done")
             else:
-                messagebox.showerror("Error", "Unsupported file!")
+                self.root.after(
+                    0, lambda: messagebox.showerror("Error", "Unsupported file!")
+                )
                 return
 
             if success and final_size < os.path.getsize(input_path) * 0.9:
@@ -208,10 +228,12 @@ class CompressMasterApp:
                     0, lambda: messagebox.showinfo("Done", "No further compression.")
                 )
 
+        except Cancelled:
+            pass
         except Exception as e:
             self.root.after(0, lambda: messagebox.showerror("Error", f"Failed:\n{e}"))
         finally:
-            update(0, "Ready")
+            update(0, "Cancelled" if cancel.cancelled else "Ready")
 
     def reset_ui(self):
         self.selected_file.set("")
@@ -1,10 +1,12 @@
 # main.py
 import os
 import logging
+import multiprocessing
 from gui.main_window import CompressMasterApp
 from utils.helpers import setup_logging
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # process-pool PDF encoding in frozen builds
     setup_logging()
     app = CompressMasterApp()
     app.run()
@@ -1,6 +1,9 @@
 # utils/helpers.py
 import logging
 import os
+import sys
+import threading
+import time
 
 
 def setup_logging():
@@ -19,3 +22,153 @@ def get_compressed_name(path):
     dir_name = os.path.dirname(path)
     name, ext = os.path.splitext(os.path.basename(path))
     return os.path.join(dir_name, f"{name}_compressed{ext}")
+
+
+class Cancelled(BaseException):
+    """Raised inside an engine whose job was cancelled.
+
+    Like KeyboardInterrupt it is not an Exception, so the engines' handlers
+    for failing pages or images let it through to the caller.
+    """
+
+
+class CancellationToken:
+    """Handed to an engine; cancel() from any thread makes it stop."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled()
+
+
+def check_cancelled(cancel):
+    if cancel is not None:
+        cancel.check()
+
+
+class BudgetExhausted(Exception):
+    """Raised inside an engine once its time budget has run out."""
+
+
+def make_deadline(time_budget=None, deadline=None):
+    """Combine a budget in seconds and an absolute time.monotonic() deadline.
+
+    Returns the earlier of the two as a monotonic time, or None for no limit.
+    """
+    if time_budget is not None:
+        end = time.monotonic() + time_budget
+        deadline = end if deadline is None else min(deadline, end)
+    return deadline
+
+
+def check_deadline(deadline):
+    if deadline is not None and time.monotonic() >= deadline:
+        raise BudgetExhausted()
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes, or None if unknown.
+
+    This is the peak over the process's whole life; see MemorySampler for
+    the peak of one job.
+    """
+    try:
+        import resource
+    except ImportError:
+        counters = _windows_memory()
+        return counters.PeakWorkingSetSize if counters else None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss():
+    """Resident memory of this process in bytes now, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    counters = _windows_memory()
+    return counters.WorkingSetSize if counters else None
+
+
+class MemorySampler:
+    """Peak resident memory while one job runs.
+
+    start() samples current_rss() every ``interval`` seconds from a
+    background thread and stop() returns the highest sample, so a job in a
+    long-lived GUI or API process is not charged with an earlier, larger
+    one.  Where the current size cannot be read, stop() falls back to the
+    process-lifetime peak_rss().
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._sample()
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._sample()
+        return self.peak if self.peak is not None else peak_rss()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        rss = current_rss()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+
+def _windows_memory():
+    # PROCESS_MEMORY_COUNTERS of this process, or None off Windows
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(
+            process, ctypes.byref(counters), counters.cb
+        ):
+            return None
+        return counters
+    except Exception:
+        return None
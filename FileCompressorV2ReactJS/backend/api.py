@@ -6,7 +6,8 @@ from fastapi.staticfiles import StaticFiles
 from core.image_compressor import compress_image
 from core.pdf_compressor import compress_pdf_to_target
 from core.office_compressor import compress_office_to_target
-from utils.helpers import get_compressed_name
+from utils.helpers import CancellationToken, Cancelled, get_compressed_name
+from utils.progress import AsyncProgress
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static", html=True), name="static")
@@ -20,19 +21,33 @@ async def health():
 def json_stream(**kw):
     import json
 
-    yield json.dumps(kw) + "\n"
+    return json.dumps(kw) + "\n"
 
 
-async def progress_cb(pct: int, txt: str):
-    yield json_stream(progress=pct, status=txt)
+def progress_line(event):
+    # one ProgressEvent as a JSON line, leaving out the fields it lacks
+    fields = {k: v for k, v in event._asdict().items() if v is not None}
+    fields["progress"] = fields.pop("percent")
+    return json_stream(**fields)
+
+
+async def watch_disconnect(request: Request, token: CancellationToken):
+    # cancel the engine once the client has gone away
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel()
+            return
+        await asyncio.sleep(0.5)
 
 
 @app.post("/compress")
 async def compress(
+    request: Request,
     file: UploadFile = File(...),
     mode: str = Form("percent"),
     percent: int = Form(75),
     target_mb: float = Form(2.0),
+    time_budget: float = Form(0.0),
 ):
     # 1. Save upload
     suffix = os.path.splitext(file.filename)[1].lower()
@@ -52,45 +67,61 @@ async def compress(
     else:
         target_bytes = target_mb * 1024 * 1024
 
-    # 4. Stream progress + final file
-    async def stream():
-        async for chunk in progress_cb(0, "Analyzing…"):
-            yield chunk
+    # a positive time budget (seconds) caps how long the engine searches
+    limits = {"time_budget": time_budget} if time_budget > 0 else {}
 
-        try:
-            ext = suffix
-            success = False
-            final_path = ""
+    def remove_temp():
+        for path in (tmp_input.name, tmp_out.name):
+            if os.path.exists(path):
+                os.unlink(path)
 
-            if ext == ".pdf":
-                success, size = await asyncio.to_thread(
-                    compress_pdf_to_target,
-                    tmp_input.name,
-                    tmp_out.name,
-                    int(target_bytes),
-                    lambda p, t: asyncio.run(progress_cb(p, t)),
-                )
-                final_path = tmp_out.name if success else tmp_input.name
-            elif ext in {".docx", ".xlsx"}:
-                success, size = await asyncio.to_thread(
-                    compress_office_to_target,
+    # 4. Stream progress + final file
+    async def stream():
+        yield json_stream(progress=0, status="Analyzing…")
+
+        ext = suffix
+        if ext == ".pdf":
+            engine = compress_pdf_to_target
+        elif ext in {".docx", ".xlsx", ".pptx"}:
+            engine = compress_office_to_target
+        elif ext in {".jpg", ".jpeg", ".png", ".webp", ".bmp"}:
+            engine = None
+        else:
+            remove_temp()
+            yield json_stream(progress=100, status="Unsupported")
+            yield json_stream(error="Unsupported file type")
+            return
+
+        token = CancellationToken()
+        watcher = asyncio.create_task(watch_disconnect(request, token))
+        progress = AsyncProgress()
+
+        def run():
+            # in a worker thread; the engine reports through progress
+            try:
+                if engine is None:
+                    result = compress_image(
+                        tmp_input.name, tmp_out.name, quality=percent, cancel=token
+                    )
+                    progress(100, "Done!", stage="done")
+                    return result
+                return engine(
                     tmp_input.name,
                     tmp_out.name,
                     int(target_bytes),
-                    lambda p, t: asyncio.run(progress_cb(p, t)),
-                )
-                final_path = tmp_out.name if success else tmp_input.name
-            elif ext in {".jpg", ".jpeg", ".png", ".webp", ".bmp"}:
-                quality = percent
-                success, size = await asyncio.to_thread(
-                    compress_image, tmp_input.name, tmp_out.name, quality=quality
+                    progress,
+                    cancel=token,
+                    **limits,
                 )
-                await progress_cb(100, "Done!")
-                final_path = tmp_out.name if success else tmp_input.name
-            else:
-                await progress_cb(100, "Unsupported")
-                yield json_stream(error="Unsupported file type")
-                return
+            finally:
+                progress.close()
+
+        job = asyncio.create_task(asyncio.to_thread(run))
+        try:
+            async for event in progress:
+                yield progress_line(event)
+            success, size = await job
+            final_path = tmp_out.name if success else tmp_input.name
 
             # send download link (data URL)
             if success and os.path.getsize(final_path) < orig_bytes * 0.9:
@@ -99,15 +130,24 @@ async def compress(
                 import base64
 
                 b64 = base64.b64encode(data).decode()
-                await progress_cb(
+                yield json_stream(
                     download=f"data:application/octet-stream;base64,{b64}",
                     filename=os.path.basename(final_path),
                 )
             else:
-                await progress_cb(status="No further compression")
+                yield json_stream(status="No further compression")
+        except Cancelled:
+            return
         finally:
-            os.unlink(tmp_input.name)
-            if os.path.exists(tmp_out.name):
-                os.unlink(tmp_out.name)
+            # also stops an engine still running when the response is torn down
+            token.cancel()
+            watcher.cancel()
+            # the engine thread may still hold the temp files; let it unwind first
+            try:
+                await asyncio.shield(job)
+            except (Cancelled, Exception):
+                pass
+            finally:
+                remove_temp()  # even if this task is cancelled while waiting
 
     return StreamingResponse(stream(), media_type="text/event-stream")
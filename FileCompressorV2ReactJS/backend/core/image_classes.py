@@ -0,0 +1,79 @@
+# core/image_classes.py
+import numpy as np
+from PIL import Image
+
+SAMPLE_PIXELS = 1024 * 1024
+GRAY_MEAN_SPREAD = 3.0  # mean per-pixel channel std. dev. of a gray image
+GRAY_PEAK_SPREAD = 12.0  # ... and its 99th percentile, for JPEG fringes
+BILEVEL_MIN_PIXELS = 64 * 64
+BILEVEL_SEPARATION = 0.9  # share of the variance Otsu's split explains
+BILEVEL_MAX_MIDTONES = 0.05  # pixels between the two tones
+BILEVEL_DARK, BILEVEL_LIGHT = 100, 155  # class means must be ink and paper
+
+
+def _sample(arr):
+    # every n-th row and column; a strided sample keeps edges sharp, where
+    # resampling would invent midtones
+    step = max(1, int((arr.shape[0] * arr.shape[1] / SAMPLE_PIXELS) ** 0.5))
+    return arr[::step, ::step]
+
+
+def _otsu(gray):
+    # (threshold, dark mean, light mean, separation) of the best two-class
+    # split of the histogram
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    p = hist / hist.sum()
+    levels = np.arange(256)
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * levels)
+    total = mu[-1]
+    variance = float((p * (levels - total) ** 2).sum())
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (total * omega - mu) ** 2 / (omega * (1 - omega))
+    between = np.nan_to_num(between[:-1])
+    t = int(np.argmax(between))
+    dark = mu[t] / omega[t] if omega[t] else 0.0
+    light = (total - mu[t]) / (1 - omega[t]) if omega[t] < 1 else 255.0
+    return t, dark, light, (between[t] / variance if variance else 0.0)
+
+
+def classify(img):
+    """Classify an L or RGB image as "bilevel", "gray" or "color".
+
+    An RGB image is gray when its channels barely differ, judged by the
+    per-pixel standard deviation across channels.  A gray image is bilevel
+    when Otsu's threshold splits its histogram into dark ink and light
+    paper that explain nearly all of its variance, with few pixels in
+    between.
+    """
+    arr = _sample(np.asarray(img))
+    if img.mode == "RGB":
+        spread = arr.astype(np.float32).std(axis=2)
+        if (
+            spread.mean() > GRAY_MEAN_SPREAD
+            or np.percentile(spread, 99) > GRAY_PEAK_SPREAD
+        ):
+            return "color"
+        arr = _sample(np.asarray(img.convert("L")))
+    elif img.mode != "L":
+        return "color"
+    if img.width * img.height < BILEVEL_MIN_PIXELS:
+        return "gray"
+    t, dark, light, separation = _otsu(arr)
+    if separation < BILEVEL_SEPARATION or dark > BILEVEL_DARK or light < BILEVEL_LIGHT:
+        return "gray"
+    margin = (light - dark) / 4
+    midtones = np.count_nonzero((arr > dark + margin) & (arr < light - margin))
+    return "bilevel" if midtones <= BILEVEL_MAX_MIDTONES * arr.size else "gray"
+
+
+def simplify(img):
+    """img as mode "1" if bilevel, "L" if gray, else unchanged."""
+    kind = classify(img)
+    if kind == "color":
+        return img
+    gray = img.convert("L") if img.mode != "L" else img
+    if kind == "gray":
+        return gray
+    t, *_ = _otsu(_sample(np.asarray(gray)))
+    return Image.fromarray(np.asarray(gray) > t)
@@ -1,55 +1,423 @@
 # core/office_compressor.py
+import hashlib
 import zipfile
+import zlib
 import tempfile
 import shutil
 import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from core.office_media import (
+    CONTENT_TYPES,
+    decode_media,
+    is_media,
+    jpeg_name,
+    rewrite_content_types,
+    rewrite_rels,
+)
+from core.pdf_compressor import bisect_search
+from core.pdf_images import (
+    DEFAULT_CACHE_BYTES,
+    ImageCache,
+    ImageRegistry,
+    encode_images,
+)
+from core.zip_raw import append_member, copy_raw
+from utils.helpers import (
+    BudgetExhausted,
+    Cancelled,
+    check_cancelled,
+    check_deadline,
+    make_deadline,
+    MemorySampler,
+)
+from utils.progress import progress_channel
 import logging
 
 log = logging.getLogger(__name__)
 
+ZIP_HEADERS = 30 + 46  # local header and central directory record
+ZIP_END_OVERHEAD = 22
+EMPTY_DEFLATE = 2
+XML_PARTS = (".xml", ".rels", ".vml")
+SAMPLE_BYTES = 64 * 1024
+MIN_DEFLATE_GAIN = 0.1  # stored members that deflate by less are copied
+CHUNK_BYTES = 1024 * 1024
+SPOOL_BYTES = 8 * 1024 * 1024  # deflated member kept in memory up to this
+
+
+def _headers(name):
+    # bytes a member takes besides its data; the name is in both headers
+    return ZIP_HEADERS + 2 * len(name.encode())
+
+
+def _lower_bound(items):
+    # no archive holding these members can be smaller
+    return ZIP_END_OVERHEAD + sum(
+        _headers(item.filename) + EMPTY_DEFLATE for item in items
+    )
+
+
+def _member_info(item, name=None, compress_type=zipfile.ZIP_DEFLATED):
+    # a fresh ZipInfo: writestr() would otherwise keep the member's original
+    # method and level, and change the input archive's own entry
+    info = zipfile.ZipInfo(name or item.filename, item.date_time)
+    info.external_attr = item.external_attr
+    info.compress_type = compress_type
+    return info
+
+
+def _deflate(source):
+    # (raw deflate stream, CRC, size) of the file source, as writestr() at
+    # level 9 stores it; read and compressed a chunk at a time into a spool
+    # that moves to disk past SPOOL_BYTES.  zlib releases the GIL, so
+    # members can be deflated in threads
+    out = tempfile.SpooledTemporaryFile(SPOOL_BYTES)
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    crc = size = 0
+    while chunk := source.read(CHUNK_BYTES):
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        out.write(compressor.compress(chunk))
+    out.write(compressor.flush())
+    out.seek(0)
+    return out, crc, size
 
-def compress_office_to_target(input_path, output_path, target_bytes, update_callback):
-    best_file = None
-    best_size = float("inf")
-    ext = os.path.splitext(input_path)[1].lower()
 
-    for level in range(9, 0, -1):
-        temp = tempfile.NamedTemporaryFile(delete=False, suffix=ext).name
+def _deflate_members(zin, items, rewritten, pool, window):
+    # yield (item, spooled deflate stream, compressed size, CRC, size) for
+    # items, in order; with a pool up to window members are deflated ahead
+    # of the consumer.  Members are opened and closed in this thread only,
+    # as ZipFile counts its open handles without a lock
+    pending = deque()
+    for item in items:
+        if item.filename in rewritten:
+            source = BytesIO(rewritten[item.filename])
+        else:
+            source = zin.open(item)
+        if pool is None:
+            result = _deflate(source)
+        else:
+            result = pool.submit(_deflate, source)
+        pending.append((item, source, result))
+        while len(pending) >= window:
+            yield _deflated(*pending.popleft())
+    while pending:
+        yield _deflated(*pending.popleft())
+
+
+def _deflated(item, source, result):
+    out, crc, size = result.result() if hasattr(result, "result") else result
+    source.close()
+    return item, out, out.seek(0, os.SEEK_END), crc, size
+
+
+def _recompress(zin, item):
+    # whether item is worth deflating again rather than copying as it is:
+    # XML parts always, stored members if a sample of them deflates well
+    if item.filename.lower().endswith(XML_PARTS):
+        return True
+    if item.compress_type != zipfile.ZIP_STORED or not item.file_size:
+        return False
+    with zin.open(item) as f:
+        sample = f.read(SAMPLE_BYTES)
+    return len(zlib.compress(sample, 1)) < (1 - MIN_DEFLATE_GAIN) * len(sample)
+
+
+def _load_media(zin, items, registry, check):
+    # decode the media members into registry, identical ones once
+    by_hash = {}  # content hash -> keys registered for it, None if kept
+    for item in items:
+        name = item.filename
+        if not is_media(name):
+            continue
+        check()
+        data = zin.read(name)
+        digest = hashlib.sha256(data).digest()
+        if digest in by_hash:
+            if by_hash[digest] is not None:
+                by_hash[digest].append(name)
+            continue
         try:
-            with zipfile.ZipFile(input_path, "r") as zin, zipfile.ZipFile(
-                temp, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=level
-            ) as zout:
-                items = zin.infolist()
-                for i, item in enumerate(items):
-                    zout.writestr(item, zin.read(item.filename))
-                    progress = 20 + (70 * (10 - level + i / len(items)) / 9)
-                    update_callback(int(progress), f"Level {level}")
-
-            size = os.path.getsize(temp)
-            log.info(f"Level {level}: {size / (1024*1024):.2f} MB")
-
-            if size <= target_bytes:
-                shutil.move(temp, output_path)
-                update_callback(100, "Done!")
-                return True, size
-
-            if size < best_size:
-                best_size = size
-                if best_file:
-                    os.unlink(best_file)
-                best_file = temp
+            img = decode_media(data)
+        except Exception as e:
+            log.debug(f"Keep media {name}: {e}")
+            img = None
+        by_hash[digest] = None if img is None else [name]
+        if img is not None:
+            registry.add(by_hash[digest], img, len(data))
+
+
+def _fixed_bytes(zin, items, registry, raw, spool, deflated, pool, window, check):
+    # size of the archive without the data of the media in registry; the
+    # members deflated to measure them are appended to the file spool, and
+    # deflated maps their names to (offset, compressed size, CRC, size)
+    media = {key for keys in registry.groups.values() for key in keys}
+    total = ZIP_END_OVERHEAD + sum(_headers(item.filename) for item in items)
+    items = [item for item in items if item.filename not in media]
+    total += sum(item.compress_size for item in items if item.filename in raw)
+    deflate = [item for item in items if item.filename not in raw]
+    for item, out, length, crc, size in _deflate_members(
+        zin, deflate, {}, pool, window
+    ):
+        with out:
+            out.seek(0)
+            deflated[item.filename] = (spool.tell(), length, crc, size)
+            shutil.copyfileobj(out, spool, CHUNK_BYTES)
+        check()
+        total += length
+    return total
+
+
+def _measure_media(quality, registry, fixed, kept, pool, workers, min_saving, runs):
+    # predicted archive size with the media encoded at quality; runs keeps
+    # the encodings of the best fitting and the smallest quality measured
+    encoded, image_stats = {}, {}
+    size = fixed
+    for canonical, keys, data, _ in encode_images(
+        registry, quality, pool, 2 * workers, min_saving=min_saving, stats=image_stats
+    ):
+        encoded[canonical] = data
+        size += (kept[canonical] if data is None else len(data)) * len(keys)
+    log.info(f"Media Q{quality}: {size / (1024*1024):.2f} MB")
+    runs[quality] = (size, encoded, image_stats)
+    return size
+
+
+def _choose(runs, target):
+    # highest measured quality that fits, else the lowest measured
+    fitting = [quality for quality, run in runs.items() if run[0] <= target]
+    return max(fitting) if fitting else min(runs, default=None)
+
+
+def _references(zin, items, renames):
+    # relationship parts and content types rewritten for renamed members
+    rewritten = {}
+    for item in items:
+        name = item.filename
+        if name == CONTENT_TYPES:
+            rewritten[name] = rewrite_content_types(zin.read(name), renames)
+        elif name.endswith(".rels"):
+            data = zin.read(name)
+            new = rewrite_rels(name, data, renames)
+            if new != data:
+                rewritten[name] = new
+    return rewritten
+
+
+def compress_office_to_target(
+    input_path,
+    output_path,
+    target_bytes,
+    update_callback,
+    recompress_media=True,
+    min_quality=5,
+    max_quality=95,
+    tolerance=0.05,
+    max_passes=6,
+    min_saving=0.05,
+    workers=None,
+    cache_bytes=DEFAULT_CACHE_BYTES,
+    time_budget=None,
+    deadline=None,
+    cancel=None,
+    stats=None,
+):
+    """Compress an Office file towards target_bytes; returns ``(success, size)``."""
+    started = time.monotonic()
+    update_callback = progress_channel(update_callback)
+    deadline = make_deadline(time_budget, deadline)
+    input_size = os.path.getsize(input_path)
+    ext = os.path.splitext(input_path)[1].lower()
+    exhausted = unreachable = False
+    status = stopped_at = ""
+    size = quality = None
+    media_passes = 0
+    runs = {}  # media quality -> (predicted size, encodings, image stats)
+    media, renames = {}, {}  # member -> JPEG data; member -> new name
+    raw = set()  # members copied without recompressing
+    registry = ImageRegistry(ImageCache(cache_bytes))
+    workers = workers or os.cpu_count() or 1
+    pool = None
+    spool = tempfile.SpooledTemporaryFile(SPOOL_BYTES)  # measured members
+    measured = {}  # member -> (offset in spool, compressed size, CRC, size)
+
+    def check():
+        check_cancelled(cancel)
+        check_deadline(deadline)
+
+    def measure(value):
+        nonlocal status, media_passes
+        check()
+        status = f"Media Q{value}"
+        progress = 30 + 40 * media_passes / max_passes
+        update_callback(int(progress), status, stage="encode")
+        media_passes += 1
+        size = _measure_media(
+            value, registry, fixed, kept, pool, workers, min_saving, runs
+        )
+        for other in set(runs) - {_choose(runs, target_bytes), min(runs)}:
+            del runs[other]  # only the encodings that can still be chosen
+        return size
+
+    temp = tempfile.NamedTemporaryFile(delete=False, suffix=ext).name
+    memory = MemorySampler().start()
+    try:
+        with zipfile.ZipFile(input_path, "r") as zin:
+            items = zin.infolist()
+            bound = _lower_bound(items)
+            if target_bytes < bound:
+                log.warning(f"Target unreachable: no archive is under {bound} bytes")
+                unreachable = True
+                items = []
+
+            if items and recompress_media:
+                status = "Decoding media"
+                update_callback(5, status, stage="analyze")
+                _load_media(zin, items, registry, check)
+            for item in items:
+                check()
+                if not _recompress(zin, item):
+                    raw.add(item.filename)
+            if items and workers > 1:
+                pool = ThreadPoolExecutor(workers)
+            if len(registry):
+                log.info(
+                    f"{len(registry)} media images in {registry.references} members"
+                )
+                status = "Measuring"
+                update_callback(20, status, stage="measure")
+                fixed = _fixed_bytes(
+                    zin, items, registry, raw, spool, measured, pool, 2 * workers, check
+                )
+                kept = {key: zin.getinfo(key).compress_size for key in registry.groups}
+                try:
+                    bisect_search(
+                        measure,
+                        min_quality,
+                        max_quality,
+                        target_bytes,
+                        tolerance=tolerance,
+                        max_passes=max_passes,
+                    )
+                except BudgetExhausted:
+                    log.warning(f"Time budget exhausted at {status}")
+                    exhausted, stopped_at = True, status
+                    deadline = None  # write what was found
+                quality = _choose(runs, target_bytes)
+
+            if quality is not None:
+                _, encoded, images = runs[quality]
+                taken = {item.filename for item in items}
+                for canonical, data in encoded.items():
+                    for key in registry.groups[canonical] if data else ():
+                        media[key] = data
+                        renames[key] = jpeg_name(key, taken)
+                        taken.add(renames[key])
+                renames = {old: new for old, new in renames.items() if old != new}
+                try:
+                    rewritten = _references(zin, items, renames) if renames else {}
+                except Exception as e:
+                    log.warning(f"Keeping media formats: {e}")
+                    media = {k: v for k, v in media.items() if k not in renames}
+                    renames, rewritten = {}, {}
+                log.info(
+                    f"Media at Q{quality}: {len(media)} re-encoded, "
+                    f"{len(renames)} renamed"
+                )
             else:
-                os.unlink(temp)
+                rewritten = {}
 
-        except Exception as e:
-            log.error(f"Level {level} failed: {e}")
-            if os.path.exists(temp):
-                os.unlink(temp)
+            if items:
+                done = media.keys() | raw | measured.keys()  # not deflated now
+                deflate = [
+                    item
+                    for item in items
+                    if item.filename in rewritten or item.filename not in done
+                ]
+                deflated = _deflate_members(zin, deflate, rewritten, pool, 2 * workers)
+                with open(input_path, "rb") as fin, zipfile.ZipFile(temp, "w") as zout:
+                    for i, item in enumerate(items):
+                        name = item.filename
+                        status = f"{i + 1}/{len(items)}"
+                        check()
+                        if name in media:
+                            info = _member_info(
+                                item, renames.get(name), zipfile.ZIP_STORED
+                            )
+                            zout.writestr(info, media[name])
+                        elif name in raw and name not in rewritten:
+                            copy_raw(fin, item, zout)
+                        elif name in measured and name not in rewritten:
+                            offset, length, crc, file_size = measured[name]
+                            info = _member_info(item)
+                            info.CRC, info.file_size = crc, file_size
+                            info.compress_size = length
+                            spool.seek(offset)
+                            append_member(zout, info, spool, length)
+                        else:
+                            _, out, length, crc, file_size = next(deflated)
+                            info = _member_info(item)
+                            info.CRC, info.file_size = crc, file_size
+                            info.compress_size = length
+                            with out:
+                                out.seek(0)
+                                append_member(zout, info, out, length)
+                        update_callback(
+                            int(70 + 25 * (i + 1) / len(items)),
+                            "Recompressing",
+                            stage="office",
+                            bytes=zout.fp.tell(),
+                        )
+                size = os.path.getsize(temp)
+                log.info(f"Recompressed: {size / (1024*1024):.2f} MB")
+    except Cancelled:
+        os.unlink(temp)
+        raise
+    except BudgetExhausted:
+        log.warning(f"Time budget exhausted at {status}")
+        exhausted, stopped_at = True, status
+    except Exception as e:
+        log.error(f"Recompression failed: {e}")
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        spool.close()
+        registry.cache.close()
+        peak = memory.stop()
+        if peak is not None:
+            log.info(f"Peak memory: {peak / (1024*1024):.0f} MB")
+
+    if stats is not None:
+        stats.update(
+            passes=1 if size is not None else 0,
+            media_passes=media_passes,
+            media_quality=quality,
+            media_reencoded=len(media),
+            media_renamed=len(renames),
+            raw_copied=len(raw - set(media)) if size is not None else 0,
+            images=runs[quality][2] if quality is not None else {},
+            budget_exhausted=exhausted,
+            stopped_at=stopped_at if exhausted else None,
+            peak_rss=peak,
+            elapsed=time.monotonic() - started,
+        )
 
-    if best_file:
-        shutil.move(best_file, output_path)
-        update_callback(100, "Best!")
-        return True, best_size
+    if size is None:
+        os.unlink(temp)
+        if unreachable:
+            update_callback(100, "Target unreachable", stage="done")
+        else:
+            update_callback(
+                100, "Out of time" if exhausted else "No change", stage="done"
+            )
+        return False, input_size
 
-    update_callback(100, "No change")
-    return False, os.path.getsize(input_path)
+    shutil.move(temp, output_path)
+    if exhausted:
+        update_callback(100, "Out of time, best so far", stage="done")
+    else:
+        update_callback(100, "Done!" if size <= target_bytes else "Best!", stage="done")
+    return True, size
@@ -0,0 +1,118 @@
+# core/office_media.py
+import html
+import posixpath
+import re
+from io import BytesIO
+from urllib.parse import quote, unquote
+from PIL import Image
+from core.image_classes import classify
+import logging
+
+log = logging.getLogger(__name__)
+
+MEDIA_DIRS = ("word/media/", "xl/media/", "ppt/media/")
+RASTER_FORMATS = {"JPEG", "PNG", "BMP", "GIF", "TIFF"}
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+CONTENT_TYPES = "[Content_Types].xml"
+TARGET = re.compile(r"""(\bTarget\s*=\s*)(["'])(.*?)\2""")
+OVERRIDE = re.compile(r"<Override\b[^>]*>")
+PART_NAME = re.compile(r"""(\bPartName\s*=\s*)(["'])(.*?)\2""")
+CONTENT_TYPE = re.compile(r"""(\bContentType\s*=\s*)(["'])(.*?)\2""")
+JPEG_DEFAULT = re.compile(r"""<Default\b[^>]*\bExtension\s*=\s*["']jpeg["']""", re.I)
+
+
+def is_media(name):
+    return name.startswith(MEDIA_DIRS) and not name.endswith("/")
+
+
+def decode_media(data):
+    """Decode a media member to re-encode as JPEG, or None to keep it as is.
+
+    Vector formats, animations, high bit depths and images that use
+    transparency are kept, since JPEG cannot hold them.  Images that are
+    effectively gray come back as mode "L", the rest as "RGB".
+    """
+    img = Image.open(BytesIO(data))
+    if img.format not in RASTER_FORMATS or getattr(img, "n_frames", 1) > 1:
+        return None
+    if img.mode in ("I", "I;16", "F"):
+        return None
+    img.load()
+    if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+        img = img.convert("RGBA")
+        if img.getextrema()[3][0] < 255:
+            return None
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    if img.mode == "RGB" and classify(img) != "color":
+        img = img.convert("L")
+    return img
+
+
+def jpeg_name(name, taken):
+    """Name for member name once it holds JPEG data, not one of taken."""
+    if name.lower().endswith(JPEG_EXTENSIONS):
+        return name
+    stem = posixpath.splitext(name)[0]
+    new, n = f"{stem}.jpeg", 1
+    while new in taken:
+        new, n = f"{stem}_{n}.jpeg", n + 1
+    return new
+
+
+def _attribute(match, value):
+    # match of one of the attribute patterns, with its value replaced
+    quote_char = match.group(2)
+    return f"{match.group(1)}{quote_char}{html.escape(value)}{quote_char}"
+
+
+def rewrite_rels(name, data, renames):
+    """Relationship part name with targets of renamed members updated.
+
+    Targets are resolved against the part the relationships belong to;
+    only the file name of a matching target changes, so relative and
+    absolute targets keep their form.
+    """
+    base = posixpath.dirname(posixpath.dirname(name))  # a/_rels/b.rels -> a
+
+    def update(match):
+        target = match.group(3)
+        path = unquote(html.unescape(target))
+        if path.startswith("/"):
+            path = path[1:]
+        else:
+            path = posixpath.normpath(posixpath.join(base, path))
+        if path not in renames:
+            return match.group(0)
+        new = posixpath.basename(renames[path])
+        if "%" in target:
+            new = quote(new)
+        folder = html.unescape(target)
+        return _attribute(match, folder[: folder.rfind("/") + 1] + new)
+
+    return TARGET.sub(update, data.decode("utf-8")).encode("utf-8")
+
+
+def rewrite_content_types(data, renames):
+    """[Content_Types].xml with renamed parts declared as JPEG."""
+    parts = {"/" + old.lower(): "/" + new for old, new in renames.items()}
+
+    def update(match):
+        element = match.group(0)
+        part = PART_NAME.search(element)
+        if part is None:
+            return element
+        new = parts.get(unquote(html.unescape(part.group(3))).lower())
+        if new is None:
+            return element
+        element = PART_NAME.sub(lambda m: _attribute(m, new), element, count=1)
+        return CONTENT_TYPE.sub(lambda m: _attribute(m, "image/jpeg"), element, count=1)
+
+    text = OVERRIDE.sub(update, data.decode("utf-8"))
+    if renames and not JPEG_DEFAULT.search(text):
+        end = text.rfind("</Types>")
+        if end < 0:
+            raise ValueError("no </Types> in [Content_Types].xml")
+        default = '<Default Extension="jpeg" ContentType="image/jpeg"/>'
+        text = text[:end] + default + text[end:]
+    return text.encode("utf-8")
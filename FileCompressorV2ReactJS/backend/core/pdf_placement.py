@@ -0,0 +1,162 @@
+# core/pdf_placement.py
+import math
+from PyPDF2.generic import ContentStream, IndirectObject, StreamObject
+from core.pdf_images import image_key
+import logging
+
+log = logging.getLogger(__name__)
+
+IDENTITY = (1, 0, 0, 1, 0, 0)
+
+
+def multiply(m, n):
+    a, b, c, d, e, f = m
+    a2, b2, c2, d2, e2, f2 = n
+    return (
+        a * a2 + b * c2,
+        a * b2 + b * d2,
+        c * a2 + d * c2,
+        c * b2 + d * d2,
+        e * a2 + f * c2 + e2,
+        e * b2 + f * d2 + f2,
+    )
+
+
+def _matrix(obj):
+    return tuple(float(x) for x in obj.get("/Matrix", IDENTITY))
+
+
+def _record(found, ref, obj, dpi):
+    key = image_key(ref)
+    found[key] = min(found.get(key, dpi), dpi)
+    # a soft mask covers the same area as its image
+    smask = obj.raw_get("/SMask") if "/SMask" in obj else None
+    if isinstance(smask, IndirectObject):
+        mask = smask.get_object()
+        _record(found, smask, mask, dpi * mask["/Width"] / obj["/Width"])
+
+
+def _draw_form(ref, form, ctm, xobjects, reader, found, walked, active):
+    # found: image key -> smallest DPI it is drawn at; walked holds the
+    # (form, transform) pairs already measured, active the forms being
+    # drawn right now so a form that draws itself ends the recursion
+    key = image_key(ref)
+    ctm = multiply(_matrix(form), ctm)
+    if key in active or (key, ctm) in walked:
+        return
+    walked.add((key, ctm))
+    active.add(key)
+    try:
+        resources = form.get("/Resources")
+        if resources is not None:
+            xobjects = resources.get_object().get("/XObject")
+            xobjects = xobjects.get_object() if xobjects is not None else {}
+        _placements(form, reader, xobjects, ctm, found, walked, active)
+    finally:
+        active.discard(key)
+
+
+def _placements(contents, reader, xobjects, ctm, found, walked, active):
+    stack = []
+    for operands, operator in ContentStream(contents, reader).operations:
+        if operator == b"q":
+            stack.append(ctm)
+        elif operator == b"Q":
+            ctm = stack.pop() if stack else IDENTITY
+        elif operator == b"cm":
+            ctm = multiply(tuple(float(x) for x in operands), ctm)
+        elif operator == b"Do" and operands[0] in xobjects:
+            ref = xobjects.raw_get(operands[0])
+            if not isinstance(ref, IndirectObject):
+                continue
+            obj = ref.get_object()
+            if obj.get("/Subtype") == "/Form":
+                _draw_form(ref, obj, ctm, xobjects, reader, found, walked, active)
+                continue
+            if obj.get("/Subtype") != "/Image":
+                continue
+            a, b, c, d, _, _ = ctm
+            width_in = math.hypot(a, b) / 72
+            height_in = math.hypot(c, d) / 72
+            if width_in <= 0 or height_in <= 0:
+                continue
+            dpi = min(obj["/Width"] / width_in, obj["/Height"] / height_in)
+            _record(found, ref, obj, dpi)
+
+
+def _appearance_ctm(form, rect):
+    # an appearance stream is scaled so its transformed bounding box fills
+    # the annotation rectangle
+    x0, y0, x1, y1 = (float(v) for v in form.get("/BBox", (0, 0, 1, 1)))
+    matrix = _matrix(form)
+    xs, ys = [], []
+    for x, y in ((x0, y0), (x0, y1), (x1, y0), (x1, y1)):
+        xs.append(matrix[0] * x + matrix[2] * y + matrix[4])
+        ys.append(matrix[1] * x + matrix[3] * y + matrix[5])
+    rx0, ry0, rx1, ry1 = (float(v) for v in rect)
+    sx = abs(rx1 - rx0) / max(max(xs) - min(xs), 1e-6)
+    sy = abs(ry1 - ry0) / max(max(ys) - min(ys), 1e-6)
+    return (sx, 0, 0, sy, min(rx0, rx1) - min(xs) * sx, min(ry0, ry1) - min(ys) * sy)
+
+
+def _draw_annotations(page, reader, found, walked, active):
+    annotations = page.get("/Annots")
+    for annotation in annotations.get_object() if annotations is not None else []:
+        annotation = annotation.get_object()
+        appearances = annotation.get("/AP")
+        if appearances is None or "/Rect" not in annotation:
+            continue
+        appearances = appearances.get_object()
+        if "/N" not in appearances:
+            continue
+        ref = appearances.raw_get("/N")
+        normal = ref.get_object()
+        if isinstance(ref, IndirectObject) and isinstance(normal, StreamObject):
+            refs = [ref]
+        else:
+            refs = [normal.raw_get(state) for state in normal]  # /On, /Off...
+        for ref in refs:
+            if isinstance(ref, IndirectObject):
+                form = ref.get_object()
+                ctm = _appearance_ctm(form, annotation["/Rect"])
+                _draw_form(ref, form, ctm, {}, reader, found, walked, active)
+
+
+def image_dpi(reader):
+    """Effective DPI of every image the pages draw.
+
+    The transform in effect at each ``Do`` maps the unit square onto the
+    page, so its column lengths are the drawn size in points.  Form
+    XObjects and annotation appearances are followed with their matrices,
+    and soft masks take the DPI of their image.  An image drawn several
+    times reports its lowest DPI, i.e. its largest use; images only reached
+    some other way (e.g. through patterns) are not reported.
+    """
+    found = {}
+    walked, active = set(), set()
+    for page_num, page in enumerate(reader.pages, start=1):
+        try:
+            contents = page.get_contents()
+            resources = page.get("/Resources")
+            xobjects = resources.get_object().get("/XObject") if resources else None
+            if contents is not None and xobjects is not None:
+                _placements(
+                    contents,
+                    reader,
+                    xobjects.get_object(),
+                    IDENTITY,
+                    found,
+                    walked,
+                    active,
+                )
+            _draw_annotations(page, reader, found, walked, active)
+        except Exception as e:
+            log.debug(f"Page {page_num}: cannot measure image DPI: {e}")
+    return found
+
+
+def dpi_scales(reader, max_dpi):
+    """Scale factor that brings each image over max_dpi down to it."""
+    return {
+        key: max_dpi / dpi for key, dpi in image_dpi(reader).items() if dpi > max_dpi
+    }
@@ -0,0 +1,549 @@
+# core/pdf_writer.py
+import hashlib
+import struct
+import zlib
+from io import BytesIO
+from PyPDF2.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+)
+import logging
+
+log = logging.getLogger(__name__)
+
+OBJECTS_PER_STREAM = 100
+MAX_DIGEST_DEPTH = 32
+MAX_NAME_TREE_DEPTH = 32
+# document-level catalog entries carried over from the input
+CATALOG_KEYS = (
+    "/Names",
+    "/Dests",
+    "/AcroForm",
+    "/StructTreeRoot",
+    "/MarkInfo",
+    "/PageLabels",
+    "/OCProperties",
+    "/ViewerPreferences",
+    "/PageLayout",
+    "/PageMode",
+    "/OpenAction",
+    "/Lang",
+    "/Metadata",
+)
+
+
+class CountingSink:
+    """Write-only stream that only counts bytes, for size measurements."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+
+def serialized_size(obj):
+    """Bytes obj takes as a top-level object with its xref entry."""
+    sink = CountingSink()
+    obj.write_to_stream(sink, None)
+    return sink.size + len("1 0 obj\n\nendobj\n") + 20
+
+
+def _resolve(value):
+    return value.get_object() if isinstance(value, IndirectObject) else value
+
+
+def _name_tree_items(node, depth=0):
+    # (key, raw value) pairs of a name tree, in order
+    node = _resolve(node)
+    if not isinstance(node, DictionaryObject) or depth > MAX_NAME_TREE_DEPTH:
+        return []
+    names = _resolve(node.get("/Names")) or []
+    items = [(_resolve(names[i]), names[i + 1]) for i in range(0, len(names) - 1, 2)]
+    for kid in _resolve(node.get("/Kids")) or []:
+        items.extend(_name_tree_items(kid, depth + 1))
+    return items
+
+
+def _name_sort_key(key):
+    # name trees are ordered by the bytes of their keys
+    if isinstance(key, bytes):
+        return bytes(key)
+    try:
+        return key.get_original_bytes()
+    except Exception:
+        return str(key).encode("utf-8")
+
+
+def _merge_name_trees(first, other):
+    # one leaf holding every key of both trees; first wins on clashes
+    items = dict(_name_tree_items(first))
+    for key, value in _name_tree_items(other):
+        items.setdefault(key, value)
+    names = ArrayObject()
+    for key in sorted(items, key=_name_sort_key):
+        names.extend((key, items[key]))
+    return DictionaryObject({NameObject("/Names"): names})
+
+
+def _merge_names(first, other):
+    merged = DictionaryObject(_resolve(first))
+    for tree, node in _resolve(other).items():
+        if tree in merged:
+            node = _merge_name_trees(merged.raw_get(tree), node)
+        merged[NameObject(tree)] = node
+    return merged
+
+
+def _merge_dests(first, other):
+    merged = DictionaryObject(_resolve(first))
+    for name, dest in _resolve(other).items():
+        merged.setdefault(name, dest)
+    return merged
+
+
+def _merge_arrays(name):
+    # the first dictionary's settings, with the name arrays of both joined
+    def merge(first, other):
+        merged = DictionaryObject(_resolve(first))
+        items = ArrayObject(_resolve(merged.get(name)) or [])
+        items.extend(_resolve(_resolve(other).get(name)) or [])
+        merged[NameObject(name)] = items
+        return merged
+
+    return merge
+
+
+MERGED_CATALOG_KEYS = {
+    "/Names": _merge_names,
+    "/Dests": _merge_dests,
+    "/AcroForm": _merge_arrays("/Fields"),
+    "/OCProperties": _merge_arrays("/OCGs"),
+}
+
+
+class PdfStreamWriter:
+    """Writes the pages of one or more PdfReaders straight to a file.
+
+    Objects are written by flush() and, with ``release``, dropped from
+    their reader's cache, so memory holds one chunk of pages at a time.
+    """
+
+    def __init__(
+        self,
+        stream,
+        reader=None,
+        transform=None,
+        object_streams=False,
+        deduplicate=True,
+        release=True,
+    ):
+        self.stream = stream
+        self.reader = reader
+        self.transform = transform
+        self.object_streams = object_streams
+        self.deduplicate = deduplicate
+        self.release = release
+        self.digests = {}  # source key -> content hash, None if not shareable
+        self.by_digest = {}  # content hash -> new object number
+        self.duplicates = 0
+        self.duplicate_bytes = 0  # serialized size of the objects replaced
+        self.packing_saved = 0  # bytes object and xref streams saved
+        self.ids = {}  # (reader, idnum, generation) -> new object number
+        self.offsets = {}  # new object number -> byte offset
+        self.packed = {}  # new object number -> (object stream number, index)
+        self.batch = []  # (new number, serialized object) not yet packed
+        self.pending = []  # (new number, source key, object or None)
+        self.next_id = 1
+        self.pages_id = self._allocate()
+        self.page_ids = []
+        self.readers = set()
+        self.outline_items = []  # top-level bookmarks of every reader
+        self.outline_links = {}  # source key of a bookmark -> replaced links
+        self.catalog = {}  # extra catalog entries: name -> value of any reader
+        self.catalog_readers = 0
+        stream.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        if reader is not None:
+            self.add_outline(reader)
+            self.add_catalog(reader)
+
+    def _allocate(self):
+        number = self.next_id
+        self.next_id += 1
+        return number
+
+    def _add_reader(self, reader):
+        # pages are written from the caller's (modified) PageObject, never
+        # from the reader, so reserve their numbers up front
+        self.readers.add(reader)
+        for page in reader.pages:
+            ref = page.indirect_reference
+            if ref is not None:
+                self.ids[(reader, ref.idnum, ref.generation)] = self._allocate()
+
+    def _ref(self, ref):
+        if ref.pdf is self:
+            return ref.idnum  # an object this writer made up itself
+        key = (ref.pdf, ref.idnum, ref.generation)
+        if key in self.ids:
+            return self.ids[key]
+        digest = self._digest(key) if self.deduplicate else None
+        if digest in self.by_digest:
+            self.ids[key] = self.by_digest[digest]
+            self.duplicates += 1
+            obj = self._drop(ref.pdf, ref.idnum, ref.generation)
+            if obj is not None:
+                self.duplicate_bytes += serialized_size(obj)
+        else:
+            self.ids[key] = self._allocate()
+            self.pending.append((self.ids[key], key, None))
+            if digest is not None:
+                self.by_digest[digest] = self.ids[key]
+        return self.ids[key]
+
+    def _resolve(self, key):
+        reader, idnum, generation = key
+        obj = reader.get_object(IndirectObject(idnum, generation, reader))
+        if self.transform is not None and obj is not None:
+            obj = self.transform((idnum, generation), obj) or obj
+        return obj
+
+    def _drop(self, reader, idnum, generation):
+        # the cached object, dropped from the reader's cache with release
+        cache = reader.resolved_objects
+        if self.release:
+            return cache.pop((generation, idnum), None)
+        return cache.get((generation, idnum))
+
+    def _digest(self, key, active=()):
+        # Hash of an object with every reference replaced by the hash of its
+        # target, so equal resources from different files hash alike.  None
+        # means the object keeps its own identity: pages, rewired bookmarks,
+        # objects on a reference cycle and very deep chains.
+        if key in self.digests:
+            return self.digests[key]
+        if key in self.ids or key in self.outline_links:
+            return None
+        if key in active or len(active) >= MAX_DIGEST_DEPTH:
+            return None
+        h = hashlib.sha256()
+        try:
+            ok = self._hash_value(self._resolve(key), h, active + (key,))
+        except Exception as e:
+            log.debug(f"Cannot hash object {key[1:]}: {e}")
+            ok = False
+        self.digests[key] = h.digest() if ok else None
+        return self.digests[key]
+
+    def _hash_value(self, value, h, active):
+        if value is None:
+            h.update(b"null")
+        elif isinstance(value, IndirectObject):
+            if value.pdf is self:
+                h.update(f"R{value.idnum}".encode())
+                return True
+            key = (value.pdf, value.idnum, value.generation)
+            digest = self.digests.get(key)
+            if digest is None and key in self.ids:
+                h.update(f"R{self.ids[key]}".encode())  # a page or unique object
+                return True
+            digest = digest or self._digest(key, active)
+            if digest is None:
+                return False
+            h.update(b"R" + digest)
+        elif isinstance(value, DictionaryObject):
+            h.update(b"<<")
+            for k in sorted(value.keys()):
+                if isinstance(value, StreamObject) and k == "/Length":
+                    continue
+                h.update(k.encode())
+                if not self._hash_value(value.raw_get(k), h, active):
+                    return False
+            h.update(b">>")
+            if isinstance(value, StreamObject):
+                h.update(b"stream")
+                h.update(value._data)
+        elif isinstance(value, ArrayObject):
+            h.update(b"[")
+            for item in value:
+                if not self._hash_value(item, h, active):
+                    return False
+            h.update(b"]")
+        else:
+            out = BytesIO()
+            value.write_to_stream(out, None)
+            h.update(type(value).__name__.encode() + out.getvalue())
+        return True
+
+    def add_page(self, page):
+        reader = page.pdf
+        if reader not in self.readers:
+            self._add_reader(reader)
+        ref = page.indirect_reference
+        key = (reader, ref.idnum, ref.generation) if ref is not None else None
+        number = self.ids[key] if key in self.ids else self._allocate()
+        page[NameObject("/Parent")] = IndirectObject(self.pages_id, 0, self)
+        self.page_ids.append(number)
+        self.pending.append((number, None, page))
+        if key is not None:
+            self._drop(reader, ref.idnum, ref.generation)
+
+    def add_outline(self, reader):
+        """Append the top-level bookmarks of reader to the output outline."""
+        outlines = reader.trailer["/Root"].get("/Outlines")
+        outlines = outlines.get_object() if outlines is not None else {}
+        item = outlines.raw_get("/First") if "/First" in outlines else None
+        seen = set()
+        while isinstance(item, IndirectObject) and item.idnum not in seen:
+            seen.add(item.idnum)
+            self.outline_items.append(item)
+            obj = item.get_object()
+            item = obj.raw_get("/Next") if "/Next" in obj else None
+
+    def add_catalog(self, reader):
+        """Carry the document-level catalog entries of reader over.
+
+        The entries of the first reader are kept as they are; the named
+        destinations, name trees, form fields and optional content groups
+        of later readers are merged into them.
+        """
+        root = reader.trailer["/Root"].get_object()
+        for name in CATALOG_KEYS:
+            if name not in root:
+                continue
+            value = root.raw_get(name)
+            if not self.catalog_readers:
+                self.catalog[name] = value
+            elif name in MERGED_CATALOG_KEYS:
+                merge = MERGED_CATALOG_KEYS[name]
+                if name in self.catalog:
+                    value = merge(self.catalog[name], value)
+                self.catalog[name] = value
+        self.catalog_readers += 1
+
+    def flush(self):
+        """Write every object reached so far and drop it from memory."""
+        while self.pending:
+            number, key, obj = self.pending.pop()
+            if obj is None:
+                obj = self._relink(key, self._resolve(key))
+            self._write_object(number, obj)
+            if key is not None:
+                self._drop(*key)
+            elif not isinstance(obj, StreamObject):
+                obj.clear()  # a page handed to add_page is done with
+
+    def _relink(self, key, obj):
+        # top-level bookmarks of each reader are chained after those of the
+        # reader before, under the outline root written by close()
+        links = self.outline_links.get(key)
+        if links is None:
+            return obj
+        obj = DictionaryObject(obj)
+        for name, ref in links.items():
+            if ref is None:
+                obj.pop(name, None)
+            else:
+                obj[NameObject(name)] = ref
+        return obj
+
+    def _write_object(self, number, obj):
+        if self.object_streams and not isinstance(obj, StreamObject):
+            out = BytesIO()
+            self._write_value(obj, out)
+            self.batch.append((number, out.getvalue()))
+            if len(self.batch) >= OBJECTS_PER_STREAM:
+                self._pack()
+            return
+        out = self.stream
+        self.offsets[number] = out.tell()
+        out.write(f"{number} 0 obj\n".encode())
+        self._write_value(obj, out, top=True)
+        out.write(b"\nendobj\n")
+
+    def _pack(self):
+        # one /ObjStm: "number offset" pairs, then the objects themselves
+        number = self._allocate()
+        header, body = [], BytesIO()
+        unpacked = 0  # what the objects would take written one by one
+        for index, (packed, data) in enumerate(self.batch):
+            header.append(f"{packed} {body.tell()}")
+            body.write(data)
+            body.write(b"\n")
+            self.packed[packed] = (number, index)
+            unpacked += len(f"{packed} 0 obj\n\nendobj\n") + len(data)
+        first = " ".join(header).encode() + b"\n"
+        data = zlib.compress(first + body.getvalue(), 9)
+        out = self.stream
+        self.offsets[number] = out.tell()
+        out.write(
+            f"{number} 0 obj\n<</Type /ObjStm /N {len(self.batch)} "
+            f"/First {len(first)} /Filter /FlateDecode /Length {len(data)}>>\n"
+            "stream\n".encode()
+        )
+        out.write(data)
+        out.write(b"\nendstream\nendobj\n")
+        self.packing_saved += unpacked - (out.tell() - self.offsets[number])
+        self.batch = []
+
+    def _write_value(self, value, out, top=False):
+        if value is None:
+            out.write(b"null")
+        elif isinstance(value, IndirectObject):
+            out.write(f"{self._ref(value)} 0 R".encode())
+        elif isinstance(value, StreamObject) and not top:
+            # a stream held directly, e.g. the /Contents compress_content_streams
+            # makes: streams must be indirect, so it becomes an object of its own
+            number = self._allocate()
+            self.pending.append((number, None, value))
+            out.write(f"{number} 0 R".encode())
+        elif isinstance(value, StreamObject):
+            if out is not self.stream:
+                raise ValueError("stream inside an object stream")
+            data = value._data
+            header = DictionaryObject(
+                (k, v) for k, v in value.items() if k != "/Length"
+            )
+            header[NameObject("/Length")] = NumberObject(len(data))
+            self._write_dict(header, out)
+            out.write(b"\nstream\n")
+            out.write(data)
+            out.write(b"\nendstream")
+        elif isinstance(value, DictionaryObject):
+            self._write_dict(value, out)
+        elif isinstance(value, ArrayObject):
+            out.write(b"[")
+            for i, item in enumerate(value):
+                if i:
+                    out.write(b" ")
+                self._write_value(item, out)
+            out.write(b"]")
+        else:
+            value.write_to_stream(out, None)
+
+    def _write_dict(self, value, out):
+        out.write(b"<<")
+        for k, v in value.items():
+            NameObject(k).write_to_stream(out, None)
+            out.write(b" ")
+            self._write_value(v, out)
+            out.write(b"\n")
+        out.write(b">>")
+
+    def _write_outline(self):
+        items = self.outline_items
+        root = IndirectObject(self._allocate(), 0, self)
+        for i, item in enumerate(items):
+            key = (item.pdf, item.idnum, item.generation)
+            self.outline_links[key] = {
+                "/Parent": root,
+                "/Prev": items[i - 1] if i > 0 else None,
+                "/Next": items[i + 1] if i + 1 < len(items) else None,
+            }
+        self._write_object(
+            root.idnum,
+            DictionaryObject(
+                {
+                    NameObject("/Type"): NameObject("/Outlines"),
+                    NameObject("/First"): items[0],
+                    NameObject("/Last"): items[-1],
+                    NameObject("/Count"): NumberObject(len(items)),
+                }
+            ),
+        )
+        self.flush()
+        return root
+
+    def close(self):
+        """Write the page tree, catalog and cross-reference section."""
+        info = None
+        if self.reader is not None and "/Info" in self.reader.trailer:
+            info = self.reader.trailer.raw_get("/Info")
+        info_id = self._ref(info) if isinstance(info, IndirectObject) else None
+        self.flush()
+
+        catalog = {
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(self.pages_id, 0, self),
+        }
+        if self.outline_items:
+            catalog[NameObject("/Outlines")] = self._write_outline()
+        for name, value in self.catalog.items():
+            catalog[NameObject(name)] = value
+        kids = ArrayObject(IndirectObject(n, 0, self) for n in self.page_ids)
+        self._write_object(
+            self.pages_id,
+            DictionaryObject(
+                {
+                    NameObject("/Type"): NameObject("/Pages"),
+                    NameObject("/Count"): NumberObject(len(self.page_ids)),
+                    NameObject("/Kids"): kids,
+                }
+            ),
+        )
+        root_id = self._allocate()
+        self._write_object(root_id, DictionaryObject(catalog))
+        self.flush()  # what only the catalog refers to
+        trailer = f"/Root {root_id} 0 R"
+        if info_id is not None:
+            trailer += f" /Info {info_id} 0 R"
+        if self.object_streams:
+            self._write_xref_stream(trailer)
+        else:
+            self._write_xref_table(trailer)
+
+    def _write_xref_table(self, trailer):
+        out = self.stream
+        xref = out.tell()
+        out.write(f"xref\n0 {self.next_id}\n0000000000 65535 f \n".encode())
+        for number in range(1, self.next_id):
+            offset = self.offsets.get(number)
+            if offset is None:
+                out.write(b"0000000000 65535 f \n")
+            else:
+                out.write(f"{offset:010d} 00000 n \n".encode())
+        out.write(
+            f"trailer\n<</Size {self.next_id} {trailer}>>\n"
+            f"startxref\n{xref}\n%%EOF\n".encode()
+        )
+
+    def _write_xref_stream(self, trailer):
+        if self.batch:
+            self._pack()
+        out = self.stream
+        number = self._allocate()
+        xref = self.offsets[number] = out.tell()
+        width = max(4, (max(xref, self.next_id).bit_length() + 7) // 8)
+
+        def row(kind, field, index):
+            return (
+                bytes([kind]) + field.to_bytes(width, "big") + struct.pack(">H", index)
+            )
+
+        rows = [row(0, 0, 65535)]
+        for n in range(1, self.next_id):
+            if n in self.offsets:
+                rows.append(row(1, self.offsets[n], 0))
+            elif n in self.packed:
+                rows.append(row(2, *self.packed[n]))
+            else:
+                rows.append(row(0, 0, 65535))
+        data = zlib.compress(b"".join(rows), 9)
+        out.write(
+            f"{number} 0 obj\n<</Type /XRef /Size {self.next_id} /W [1 {width} 2] "
+            f"{trailer} /Filter /FlateDecode /Length {len(data)}>>\n"
+            "stream\n".encode()
+        )
+        out.write(data)
+        out.write(b"\nendstream\nendobj\n")
+        table = 20 * self.next_id + len(f"xref\n0 {self.next_id}\ntrailer\n<<>>\n")
+        self.packing_saved += table - (out.tell() - xref)
+        out.write(f"startxref\n{xref}\n%%EOF\n".encode())
@@ -0,0 +1,145 @@
+# core/rate_allocation.py
+import heapq
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from core.pdf_images import bilevel_scaled, encode_image, scaled_size
+from core.size_model import sample_region
+import logging
+
+log = logging.getLogger(__name__)
+
+QUALITY_LADDER = (95, 85, 75, 65, 55, 45, 35, 25, 15)
+SCALE_LADDER = (1.0, 0.75, 0.5)
+
+
+def _lower_hull(points):
+    # points are (bytes, distortion, quality, scale); keep the convex,
+    # Pareto-optimal ones so greedy moves always have increasing cost
+    pareto = []
+    for point in sorted(points, key=lambda p: (p[0], p[1])):
+        if not pareto or point[1] < pareto[-1][1]:
+            pareto.append(point)
+    hull = []
+    for point in pareto:
+        while len(hull) >= 2:
+            (r0, d0, *_), (r1, d1, *_) = hull[-2], hull[-1]
+            if (d1 - d0) * (point[0] - r1) >= (point[1] - d1) * (r1 - r0):
+                hull.pop()
+            else:
+                break
+        hull.append(point)
+    return hull
+
+
+def rate_distortion(img, original=None, qualities=QUALITY_LADDER, scales=SCALE_LADDER):
+    """Rate/distortion hull of one image over (quality, scale) candidates.
+
+    Candidates are measured on sample_region(img) and scaled up to the whole
+    image: bytes are the JPEG size, distortion the summed squared error
+    against the original after scaling back up.  With ``original`` (bytes
+    of the source stream) keeping the image as-is is a candidate too, with
+    quality None and no distortion.  The hull is ordered from the smallest
+    to the largest encoding.
+    """
+    region = sample_region(img)
+    factor = img.width * img.height / (region.width * region.height)
+    bilevel = img.mode == "1"
+    reference = np.asarray(region.convert("L") if bilevel else region, np.float32)
+    points = []
+    for scale in scales:
+        if scale < 1 and min(scaled_size(region.size, scale)) < 8:
+            continue
+        # a 1-bit encoding does not depend on quality
+        for quality in qualities[:1] if bilevel else qualities:
+            data = encode_image(region, quality, scale)
+            if bilevel:
+                out = bilevel_scaled(region, scale).convert("L")
+            else:
+                out = Image.open(BytesIO(data))
+            with out:
+                if out.size != region.size:
+                    out = out.resize(region.size, Image.BILINEAR)
+                error = np.asarray(out, dtype=np.float32) - reference
+            sse = float(np.square(error).sum())
+            points.append((len(data) * factor, sse * factor, quality, scale))
+    if original is not None:
+        points.append((original, 0.0, None, 1.0))
+    return _lower_hull(points)
+
+
+def allocate(hulls, copies, fixed_bytes, target):
+    """Pick one hull point per image so the total fits target.
+
+    Starts every image at its largest candidate and repeatedly takes the
+    step that saves the most bytes per unit of added distortion until the
+    predicted size fits, then spends what is left of the budget on the
+    upgrades that remove the most distortion per byte.  ``copies`` weighs
+    each image's distortion by the references drawing it; its bytes count
+    once, as the writer stores identical streams once.  Returns
+    ``({key: (quality, scale)}, predicted)``.
+    """
+    pos = {key: len(hull) - 1 for key, hull in hulls.items()}
+    total = fixed_bytes + sum(hulls[key][pos[key]][0] for key in hulls if hulls[key])
+    heap = []
+
+    def push(key):
+        i = pos[key]
+        if i > 0:
+            (r0, d0, *_), (r1, d1, *_) = hulls[key][i - 1], hulls[key][i]
+            saved = r1 - r0
+            heapq.heappush(heap, ((d0 - d1) * copies[key] / max(saved, 1), key))
+
+    for key in hulls:
+        push(key)
+    while total > target and heap:
+        _, key = heapq.heappop(heap)
+        i = pos[key]
+        total -= hulls[key][i][0] - hulls[key][i - 1][0]
+        pos[key] = i - 1
+        push(key)
+
+    while True:
+        best = None
+        for key, hull in hulls.items():
+            i = pos[key]
+            if i + 1 >= len(hull):
+                continue
+            extra = hull[i + 1][0] - hull[i][0]
+            if total + extra > target:
+                continue
+            gain = (hull[i][1] - hull[i + 1][1]) * copies[key] / max(extra, 1)
+            if best is None or gain > best[0]:
+                best = (gain, key, extra)
+        if best is None:
+            break
+        _, key, extra = best
+        pos[key] += 1
+        total += extra
+
+    settings = {
+        key: (hull[pos[key]][2], hull[pos[key]][3]) for key, hull in hulls.items()
+    }
+    return settings, total
+
+
+def build_hulls(registry, pool=None, window=1, check=None):
+    # hand images to the pool a window at a time to respect the cache cap;
+    # check, if given, runs before each window and may raise to stop
+    keys = list(registry.groups)
+    hulls = []
+    for start in range(0, len(keys), window):
+        if check is not None:
+            check()
+        batch = keys[start : start + window]
+        images = [registry.cache.get(key) for key in batch]
+        # downsampled images cannot keep their original stream
+        originals = [
+            None if key in registry.downsampled else registry.original[key]
+            for key in batch
+        ]
+        if pool is None:
+            hulls.extend(map(rate_distortion, images, originals))
+        else:
+            hulls.extend(pool.map(rate_distortion, images, originals))
+    return dict(zip(keys, hulls))
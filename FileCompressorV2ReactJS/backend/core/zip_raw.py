@@ -0,0 +1,62 @@
+# core/zip_raw.py
+import struct
+import zipfile
+
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+LOCAL_SIGNATURE = b"PK\x03\x04"
+DATA_DESCRIPTOR = 0x08
+COPY_CHUNK = 1024 * 1024
+
+
+def raw_range(fp, item):
+    """(offset, length) of item's compressed data in the archive file fp."""
+    fp.seek(item.header_offset)
+    fields = LOCAL_HEADER.unpack(fp.read(LOCAL_HEADER.size))
+    if fields[0] != LOCAL_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad local header for {item.filename}")
+    name_length, extra_length = fields[-2:]
+    offset = item.header_offset + LOCAL_HEADER.size + name_length + extra_length
+    return offset, item.compress_size
+
+
+def append_member(zout, info, source, length):
+    """Append a member whose data is already compressed to zout.
+
+    info carries the member's name, method, CRC and sizes; the ``length``
+    compressed bytes are read from the file source, in chunks, after a
+    local header built from info.  zout registers the entry as if it had
+    written it, so its central directory lists it.  zout must be a ZipFile
+    open for writing on a seekable file.
+    """
+    info.flag_bits &= ~DATA_DESCRIPTOR  # sizes are known
+    zip64 = max(info.file_size, info.compress_size) > zipfile.ZIP64_LIMIT
+
+    # what ZipFile._open_to_write does before handing out a writer
+    zout.fp.seek(zout.start_dir)
+    info.header_offset = zout.fp.tell()
+    zout._writecheck(info)
+    zout._didModify = True
+    zout.fp.write(info.FileHeader(zip64))
+    while length:
+        chunk = source.read(min(COPY_CHUNK, length))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data for {info.filename}")
+        zout.fp.write(chunk)
+        length -= len(chunk)
+    zout.filelist.append(info)
+    zout.NameToInfo[info.filename] = info
+    zout.start_dir = zout.fp.tell()
+
+
+def copy_raw(fp, item, zout):
+    """Append item of the archive file fp to zout without recompressing it."""
+    offset, length = raw_range(fp, item)
+    info = zipfile.ZipInfo(item.filename, item.date_time)
+    info.external_attr = item.external_attr
+    info.compress_type = item.compress_type
+    info.flag_bits = item.flag_bits
+    info.CRC = item.CRC
+    info.compress_size = item.compress_size
+    info.file_size = item.file_size
+    fp.seek(offset)
+    append_member(zout, info, fp, length)
@@ -5,6 +5,7 @@ import threading
 import webbrowser
 import time
 import socket
+import multiprocessing
 
 # --- CRITICAL: Import api FIRST so PyInstaller sees it ---
 try:
@@ -59,6 +60,8 @@ def start_server():
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # process-pool PDF encoding in frozen builds
+
     # 1. Start server in a normal (non-daemon) thread
     server_thread = threading.Thread(target=start_server, daemon=False)
     server_thread.start()
@@ -0,0 +1,139 @@
+# utils/progress.py
+import asyncio
+import queue
+import threading
+import time
+from collections import namedtuple
+
+DEFAULT_RATE = 20.0  # events per second
+
+ProgressEvent = namedtuple(
+    "ProgressEvent",
+    "percent status stage page pages image images bytes",
+    defaults=(None,) * 6,
+)
+ProgressEvent.__doc__ = """One progress report of an engine.
+
+percent and status are what the engines always reported; stage names the
+step ("analyze", "measure", "encode", "write", "lossless", "office" or
+"done"), page/pages and image/images count the work done in it and bytes
+is the size of the output written so far.  Fields an engine does not know
+are None.
+"""
+
+
+class ProgressChannel:
+    """Thread-safe, rate-limited progress reporting.
+
+    Engines call a channel like the plain ``update_callback(percent,
+    status)`` they always took, optionally with the other ProgressEvent
+    fields as keywords, from any thread.  At most ``max_rate`` events a
+    second reach ``sink``; an event arriving sooner replaces the pending
+    one, which flush() delivers.  Events at 0 or 100 percent and the first
+    event of a new stage always go through.
+    """
+
+    def __init__(self, sink, max_rate=DEFAULT_RATE):
+        self.sink = sink
+        self.interval = 1 / max_rate if max_rate else 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._last = None  # time.monotonic() of the last event sent
+        self._stage = None
+        self._pending = None
+
+    def __call__(self, percent, status, **fields):
+        event = ProgressEvent(percent, status, **fields)
+        now = time.monotonic()
+        with self._lock:
+            if (
+                self._last is not None
+                and now - self._last < self.interval
+                and percent not in (0, 100)
+                and event.stage == self._stage
+            ):
+                if self._pending is not None:
+                    self.dropped += 1
+                self._pending = event
+                return
+            self._send(event, now)
+
+    def flush(self):
+        with self._lock:
+            if self._pending is not None:
+                self._send(self._pending, time.monotonic())
+
+    def _send(self, event, now):
+        # under the lock, so sinks see events in the order they were made
+        self._last, self._stage, self._pending = now, event.stage, None
+        self.sink(event)
+
+
+def progress_channel(callback, max_rate=DEFAULT_RATE):
+    """callback as a ProgressChannel.
+
+    A channel is returned as it is; any other callable is called with
+    ``(percent, status)`` only, as before.
+    """
+    if isinstance(callback, ProgressChannel):
+        return callback
+    return ProgressChannel(
+        lambda event: callback(event.percent, event.status), max_rate
+    )
+
+
+class TkProgress(ProgressChannel):
+    """Channel whose events are handled on the Tk main loop.
+
+    Worker threads only queue events; once start() has been called from
+    the main thread, the queue is drained every ``poll_ms`` through
+    ``root.after`` and the latest event is passed to ``handler``.
+    """
+
+    def __init__(self, root, handler, max_rate=DEFAULT_RATE, poll_ms=50):
+        self._queue = queue.SimpleQueue()
+        super().__init__(self._queue.put, max_rate)
+        self.root = root
+        self.handler = handler
+        self.poll_ms = poll_ms
+
+    def start(self):
+        self.root.after(self.poll_ms, self._drain)
+
+    def _drain(self):
+        latest = None
+        while not self._queue.empty():
+            latest = self._queue.get_nowait()
+        if latest is not None:
+            self.handler(latest)
+        self.root.after(self.poll_ms, self._drain)
+
+
+class AsyncProgress(ProgressChannel):
+    """Channel read with ``async for`` on an asyncio event loop.
+
+    Create it on the loop; engines may report from any thread, and close()
+    (from any thread too) delivers the pending event and ends the
+    iteration.
+    """
+
+    def __init__(self, max_rate=DEFAULT_RATE, loop=None):
+        self._loop = loop or asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        super().__init__(self._put, max_rate)
+
+    def _put(self, event):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+    def close(self):
+        self.flush()
+        self._put(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self._queue.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
@@ -117,7 +117,7 @@ export default function App() {
           ref={fileInputRef}
           type="file"
           className="hidden"
-          accept=".pdf,.docx,.xlsx,.jpg,.jpeg,.png,.webp,.bmp"
+          accept=".pdf,.docx,.xlsx,.pptx,.jpg,.jpeg,.png,.webp,.bmp"
           onChange={(e) => setFile(e.target.files?.[0] ?? null)}
         />
 
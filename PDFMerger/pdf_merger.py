@@ -36,6 +36,7 @@ from tkinter import (
 from tkinterdnd2 import DND_FILES, TkinterDnD
 from PyPDF2 import PdfMerger, PdfReader
 from PyPDF2.errors import PdfReadError, WrongPasswordError
+from pdf_writer import PdfStreamWriter
 import requests
 import pytz
 
@@ -177,6 +178,7 @@ class PDFMergerPro:
         self.auto_naming = self.settings.get("auto_naming", True)
         self.default_folder = self.settings.get("default_folder", "desktop")
         self.custom_path = self.settings.get("custom_path", "")
+        self.compact_output = self.settings.get("compact_output", True)
 
         # ---- Load offline feedback + start retry worker ----
         load_pending_feedback()
@@ -203,6 +205,7 @@ class PDFMergerPro:
         data = {
             "auto_naming": self.auto_naming,
             "default_folder": self.default_folder,
+            "compact_output": self.compact_output,
         }
         if self.default_folder == "custom":
             data["custom_path"] = self.custom_path
@@ -795,8 +798,8 @@ Enjoy fast, clean, and professional PDF merging!
         settings_win.transient(self.root)
         settings_win.grab_set()
         settings_win.resizable(False, False)
-        settings_win.geometry("600x400")
-        self.center_over_parent(settings_win, 600, 400)
+        settings_win.geometry("600x430")
+        self.center_over_parent(settings_win, 600, 430)
 
         icon_path = Path("icons/pdf_merger.ico")
         if getattr(sys, "frozen", False):
@@ -824,6 +827,17 @@ Enjoy fast, clean, and professional PDF merging!
             fg="#e0e0e0",
             selectcolor="#1e1e2e",
             font=("Segoe UI", 10),
+        ).pack(anchor="w", pady=(0, 5))
+
+        compact_var = IntVar(value=1 if self.compact_output else 0)
+        Checkbutton(
+            frame,
+            text="Compact output (object streams, needs a PDF 1.5+ reader)",
+            variable=compact_var,
+            bg="#0f0f1a",
+            fg="#e0e0e0",
+            selectcolor="#1e1e2e",
+            font=("Segoe UI", 10),
         ).pack(anchor="w", pady=(0, 15))
 
         folder_var = StringVar(value=self.default_folder)
@@ -891,6 +905,7 @@ Enjoy fast, clean, and professional PDF merging!
 
         def save():
             self.auto_naming = bool(auto_var.get())
+            self.compact_output = bool(compact_var.get())
             self.default_folder = folder_var.get()
             if self.default_folder == "custom":
                 self.custom_path = self.custom_path_var.get()
@@ -1170,6 +1185,9 @@ Enjoy fast, clean, and professional PDF merging!
         self.actual_merge(valid_files, output_path, total_pages)
 
     def actual_merge(self, valid_files, output_path, total_pages):
+        if self.compact_output:
+            self.compact_merge(valid_files, output_path, total_pages)
+            return
         merger = PdfMerger()
         processed = 0
 
@@ -1179,21 +1197,9 @@ Enjoy fast, clean, and professional PDF merging!
                 pages = len(reader.pages)
                 merger.append(pdf)
                 processed += pages
-                percent = int((processed / total_pages) * 100)
-                self.root.after(
-                    0,
-                    lambda p=percent: [
-                        self.progress.config(value=p),
-                        self.progress_label.config(text=f"Merging... {p}%"),
-                    ],
-                )
+                self.show_merge_progress(int((processed / total_pages) * 100))
             except Exception:
-                self.root.after(
-                    0,
-                    lambda: messagebox.showerror(
-                        "Merge Error", f"Failed during merge: {os.path.basename(pdf)}"
-                    ),
-                )
+                self.show_merge_error(pdf)
                 self.finish_merge()
                 return
 
@@ -1201,29 +1207,90 @@ Enjoy fast, clean, and professional PDF merging!
             os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
             merger.write(output_path)
             merger.close()
-            self.root.after(
-                0,
-                lambda: [
-                    self.progress.config(value=100),
-                    self.progress_label.config(text="Saving..."),
-                    messagebox.showinfo(
-                        "Success!",
-                        f"Merged {len(valid_files)} file(s)\n"
-                        f"{total_pages} page(s) total\n"
-                        f"Saved to:\n{output_path}",
-                    ),
-                ],
-            )
+            self.show_merge_success(valid_files, output_path, total_pages)
         except Exception as e:
-            self.root.after(
-                0,
-                lambda: messagebox.showerror(
-                    "Save Failed", f"Could not save file:\n{e}"
-                ),
-            )
+            self.show_save_error(e)
 
         self.finish_merge()
 
+    def compact_merge(self, valid_files, output_path, total_pages):
+        # Pages go straight from each file to the output, which packs the
+        # small objects into compressed object streams as it goes; named
+        # destinations and form fields of every file are merged, the other
+        # document-level settings come from the first file.
+        processed = 0
+        failed = None
+        try:
+            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+            with open(output_path, "wb") as out:
+                writer = PdfStreamWriter(out, object_streams=True)
+                for pdf in valid_files:
+                    try:
+                        reader = PdfReader(pdf)
+                        if reader.is_encrypted:
+                            reader.decrypt("")
+                        for page in reader.pages:
+                            writer.add_page(page)
+                        writer.add_outline(reader)
+                        writer.add_catalog(reader)
+                        writer.flush()
+                    except Exception:
+                        failed = pdf
+                        break
+                    processed += len(reader.pages)
+                    self.show_merge_progress(int((processed / total_pages) * 100))
+                else:
+                    writer.close()
+        except Exception as e:
+            self.show_save_error(e)
+            self.finish_merge()
+            return
+
+        if failed:
+            os.remove(output_path)  # incomplete
+            self.show_merge_error(failed)
+        else:
+            self.show_merge_success(valid_files, output_path, total_pages)
+        self.finish_merge()
+
+    def show_merge_progress(self, percent):
+        self.root.after(
+            0,
+            lambda p=percent: [
+                self.progress.config(value=p),
+                self.progress_label.config(text=f"Merging... {p}%"),
+            ],
+        )
+
+    def show_merge_error(self, pdf):
+        self.root.after(
+            0,
+            lambda: messagebox.showerror(
+                "Merge Error", f"Failed during merge: {os.path.basename(pdf)}"
+            ),
+        )
+
+    def show_merge_success(self, valid_files, output_path, total_pages):
+        self.root.after(
+            0,
+            lambda: [
+                self.progress.config(value=100),
+                self.progress_label.config(text="Saving..."),
+                messagebox.showinfo(
+                    "Success!",
+                    f"Merged {len(valid_files)} file(s)\n"
+                    f"{total_pages} page(s) total\n"
+                    f"Saved to:\n{output_path}",
+                ),
+            ],
+        )
+
+    def show_save_error(self, e):
+        self.root.after(
+            0,
+            lambda: messagebox.showerror("Save Failed", f"Could not save file:\n{e}"),
+        )
+
     def finish_merge(self):
         self.root.after(
             0,